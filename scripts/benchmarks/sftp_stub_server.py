@@ -0,0 +1,229 @@
+"""A local SFTP server stand-in for benchmarks, serving a temporary folder over
+paramiko on 127.0.0.1. Optionally routes the traffic through a proxy that adds
+a fixed delay in each direction to emulate a high-latency link."""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+
+class _StubServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+class _StubHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class _StubSFTPServer(paramiko.SFTPServerInterface):
+    root = None
+
+    def _local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def list_folder(self, path):
+        try:
+            local = self._local(path)
+            return [
+                paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(local, name)), name)
+                for name in os.listdir(local)
+            ]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        try:
+            fd = os.open(local, flags | getattr(os, "O_BINARY", 0), 0o666)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _StubHandle(flags)
+        handle.filename = local
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        try:
+            if attr._flags & attr.FLAG_AMTIME:
+                os.utime(self._local(path), (attr.st_atime, attr.st_mtime))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class _DelayProxy:
+    """Forwards TCP traffic, holding every chunk back for delay seconds"""
+
+    def __init__(self, target_port: int, delay: float):
+        self.target_port = target_port
+        self.delay = delay
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            for source, destination in ((client, upstream), (upstream, client)):
+                self._pipe(source, destination)
+
+    def _pipe(self, source, destination):
+        pending = deque()
+        ready = threading.Condition()
+
+        def read():
+            while True:
+                try:
+                    data = source.recv(2**16)
+                except OSError:
+                    data = b""
+                with ready:
+                    pending.append((time.monotonic() + self.delay, data))
+                    ready.notify()
+                if not data:
+                    return
+
+        def write():
+            while True:
+                with ready:
+                    while not pending:
+                        ready.wait()
+                    due, data = pending.popleft()
+                time.sleep(max(0, due - time.monotonic()))
+                if not data:
+                    destination.close()
+                    return
+                try:
+                    destination.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+
+class StubSFTPServer:
+    """Serve root over SFTP on 127.0.0.1 until close() is called
+
+    Args:
+        root (str): The local folder exposed as the remote file system
+        latency (float): Seconds added to each direction of the traffic
+
+    Attributes:
+        port (int): The port clients should connect to
+        known_hosts (str): A known_hosts file trusting the server key
+    """
+
+    def __init__(self, root: str, latency: float = 0):
+        self.root = root
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.transports = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+        self.proxy = None
+        self.port = self.listener.getsockname()[1]
+        if latency > 0:
+            self.proxy = _DelayProxy(self.port, latency)
+            self.port = self.proxy.port
+
+        self.known_hosts = os.path.join(root, ".known_hosts")
+        host_keys = paramiko.HostKeys()
+        host_keys.add(f"[127.0.0.1]:{self.port}", self.host_key.get_name(), self.host_key)
+        host_keys.save(self.known_hosts)
+
+    def _accept(self):
+        server_class = type("_RootedSFTPServer", (_StubSFTPServer,), {"root": self.root})
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, server_class)
+            transport.start_server(server=_StubServer())
+            self.transports.append(transport)
+
+    def close(self):
+        self.listener.close()
+        if self.proxy is not None:
+            self.proxy.close()
+        for transport in self.transports:
+            transport.close()
@@ -0,0 +1,89 @@
+"""Measure SFTPClient throughput against a local SFTP server stand-in.
+
+Compares the default upload with the chunked upload of a single large file,
+and the default download with the tuned channel settings, optionally over an
+emulated high-latency link. The tuned settings only enlarge the window and
+packet size the server may send to us, so they are measured on downloads.
+
+    python sftp_throughput.py --size-mb 256 --latency-ms 50 --workers 4
+"""
+import argparse
+import filecmp
+import logging
+import os
+import tempfile
+import time
+
+from pyprediktorutilities.file_transfer import SFTPClient
+from sftp_stub_server import StubSFTPServer
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def _measure(label: str, size: int, transfer) -> float:
+    start = time.perf_counter()
+    transfer()
+    elapsed = time.perf_counter() - start
+    throughput = size / elapsed / 2**20
+    print(f"{label:<32} {elapsed:8.2f} s {throughput:10.1f} MiB/s")
+    return throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=128, help="Size of the test file")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added per direction")
+    parser.add_argument("--workers", type=int, default=4, help="Workers for the chunked upload")
+    parser.add_argument("--chunk-mb", type=int, default=16, help="Chunk size for the chunked upload")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as local, tempfile.TemporaryDirectory() as remote:
+        server = StubSFTPServer(remote, latency=args.latency_ms / 1000)
+        file = os.path.join(local, "archive.bin")
+        size = args.size_mb * 2**20
+        with open(file, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(2**20))
+
+        def client(**kwargs) -> SFTPClient:
+            return SFTPClient(
+                "127.0.0.1", "user", "password", server.port, known_hosts=server.known_hosts, **kwargs
+            )
+
+        print(f"Transferring {args.size_mb} MiB with {args.latency_ms} ms added latency")
+        results = {}
+        with client() as default:
+            results["default"] = _measure(
+                "put, paramiko defaults", size, lambda: default.upload([file], "/default")
+            )
+            results["chunked"] = _measure(
+                f"put, chunked, {args.workers} workers",
+                size,
+                lambda: default.upload_large(
+                    file, "/chunked", chunk_size=args.chunk_mb * 2**20, max_workers=args.workers
+                ),
+            )
+        for name in results:
+            uploaded = os.path.join(remote, name, "archive.bin")
+            assert filecmp.cmp(file, uploaded, shallow=False), f"{name} upload is corrupt"
+
+        downloads = {}
+        for name, options in (("default", {}), ("tuned", {"tuned": True})):
+            target = os.path.join(local, name)
+            os.mkdir(target)
+            with client(**options) as downloader:
+                downloads[name] = _measure(
+                    f"get, {'tuned window/packet' if options else 'paramiko defaults'}",
+                    size,
+                    lambda: downloader.download(["/default/archive.bin"], target),
+                )
+            downloaded = os.path.join(target, "archive.bin")
+            assert filecmp.cmp(file, downloaded, shallow=False), f"{name} download is corrupt"
+
+        print(f"Chunked upload speed-up over default: {results['chunked'] / results['default']:.1f}x")
+        print(f"Tuned download speed-up over default: {downloads['tuned'] / downloads['default']:.1f}x")
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
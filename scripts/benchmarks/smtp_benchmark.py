@@ -0,0 +1,183 @@
+"""Measure SendEmail delivery rate and memory against a local SMTP server stand-in.
+
+Runs single sends (a connection per email), a session, send_bulk, an
+EmailQueue and large attachments, and flags regressions: connections or logins
+that are not reused, attachments held in memory instead of streamed, shared
+attachments encoded for every email, and rates below a saved baseline.
+
+    python smtp_benchmark.py --messages 500 --attachment-mb 100
+    python smtp_benchmark.py --save-baseline baseline.json
+    python smtp_benchmark.py --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pyprediktorutilities.send_email import EmailQueue, SendEmail
+from smtp_stub_server import StubSMTPServer
+
+logging.basicConfig(level=logging.WARNING)
+
+SENDER = "benchmark@localhost.com"
+RECIPIENTS = ["sink@localhost.com"]
+
+
+class Benchmark:
+    def __init__(self, server: StubSMTPServer) -> None:
+        self.server = server
+        self.results = {}
+        self.regressions = []
+
+    def email(self, **kwargs) -> SendEmail:
+        return SendEmail("127.0.0.1", self.server.port, "user", "password", **kwargs)
+
+    def measure(self, name: str, messages: int, send, trace_memory: bool = False) -> dict:
+        self.server.reset()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        send()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        counters = self.server.counters()
+        if counters["messages"] != messages:
+            self.flag(f"{name}: the server received {counters['messages']} of {messages} emails")
+        result = {
+            "messages": messages,
+            "seconds": seconds,
+            "messages_per_second": messages / seconds,
+            "connections": counters["connections"],
+            "logins": counters["logins"],
+            "peak_mib": peak / 2**20 if peak is not None else None,
+        }
+        self.results[name] = result
+        peak = f"{result['peak_mib']:9.1f}" if peak is not None else f"{'-':>9}"
+        print(
+            f"{name:<24} {messages:6d} {seconds:8.2f} {result['messages_per_second']:10.1f} "
+            f"{result['connections']:6d} {result['logins']:6d} {peak}"
+        )
+        return result
+
+    def flag(self, message: str) -> None:
+        self.regressions.append(message)
+
+    def expect_at_most(self, name: str, counter: str, limit: int) -> None:
+        value = self.results[name][counter]
+        if value > limit:
+            self.flag(f"{name}: {value} {counter}, expected at most {limit}")
+
+    def compare(self, baseline: dict, tolerance: float) -> None:
+        for name, result in self.results.items():
+            if name not in baseline:
+                continue
+            expected = baseline[name]["messages_per_second"]
+            if result["messages_per_second"] < expected * (1 - tolerance):
+                self.flag(
+                    f"{name}: {result['messages_per_second']:.1f} emails/s, "
+                    f"baseline {expected:.1f} emails/s"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200, help="Emails per scenario")
+    parser.add_argument("--workers", type=int, default=4, help="Workers for the EmailQueue")
+    parser.add_argument("--attachment-mb", type=int, default=50, help="Size of the large attachment")
+    parser.add_argument("--shared-attachment-mb", type=int, default=2, help="Size of the shared attachment")
+    parser.add_argument("--memory-budget-mb", type=float, default=16, help="Allowed peak memory for the large attachment")
+    parser.add_argument("--baseline", help="JSON file with the rates to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed drop in rate from the baseline")
+    parser.add_argument("--save-baseline", help="Write the measured rates to this JSON file")
+    args = parser.parse_args()
+
+    server = StubSMTPServer()
+    benchmark = Benchmark(server)
+    n = args.messages
+    message = dict(from_email=SENDER, recipients=RECIPIENTS, subject="Benchmark", body="Hello " * 200)
+
+    print(f"{'scenario':<24} {'emails':>6} {'seconds':>8} {'emails/s':>10} {'conns':>6} {'logins':>6} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark.measure("single", n, lambda: [benchmark.email().send_email(**message) for _ in range(n)])
+
+        def session():
+            with benchmark.email() as email:
+                for _ in range(n):
+                    email.send_email(**message)
+
+        benchmark.measure("session", n, session)
+        benchmark.expect_at_most("session", "connections", 1)
+        benchmark.expect_at_most("session", "logins", 1)
+
+        benchmark.measure("send_bulk", n, lambda: benchmark.email().send_bulk([message] * n))
+        benchmark.expect_at_most("send_bulk", "connections", 1)
+        benchmark.expect_at_most("send_bulk", "logins", 1)
+
+        def queued():
+            with EmailQueue(benchmark.email(), workers=args.workers) as outbox:
+                for _ in range(n):
+                    outbox.submit(**message)
+
+        benchmark.measure(f"queue, {args.workers} workers", n, queued)
+        benchmark.expect_at_most(f"queue, {args.workers} workers", "connections", args.workers)
+
+        shared = os.path.join(directory, "shared.bin")
+        with open(shared, "wb") as f:
+            f.write(os.urandom(args.shared_attachment_mb * 2**20))
+        email = benchmark.email()
+        encode = email._attachments._encode
+        encodes = []
+        email._attachments._encode = lambda file: encodes.append(file) or encode(file)
+        shared_count = max(n // 10, 2)
+
+        def shared_attachment():
+            with email:
+                for _ in range(shared_count):
+                    email.send_email(**message, files=[shared])
+
+        benchmark.measure(f"shared {args.shared_attachment_mb} MiB attachment", shared_count, shared_attachment)
+        # The first email streams the file, the second keeps it encoded
+        if len(encodes) != 2:
+            benchmark.flag(f"shared attachment: encoded {len(encodes)} times, expected twice")
+
+        large = os.path.join(directory, "large.bin")
+        with open(large, "wb") as f:
+            for _ in range(args.attachment_mb):
+                f.write(os.urandom(2**20))
+        name = f"{args.attachment_mb} MiB attachment"
+        result = benchmark.measure(
+            name,
+            1,
+            lambda: benchmark.email().send_email(**message, files=[large]),
+            trace_memory=True,
+        )
+        if result["peak_mib"] > args.memory_budget_mb:
+            benchmark.flag(
+                f"{name}: peak memory {result['peak_mib']:.1f} MiB, "
+                f"budget {args.memory_budget_mb} MiB"
+            )
+    server.close()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            benchmark.compare(json.load(f), args.tolerance)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(benchmark.results, f, indent=2)
+
+    if benchmark.regressions:
+        print("\nRegressions:")
+        for regression in benchmark.regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
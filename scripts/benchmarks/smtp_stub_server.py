@@ -0,0 +1,172 @@
+"""A local SMTP server stand-in for benchmarks. It speaks enough ESMTP for
+SendEmail (EHLO, STARTTLS with a self-signed certificate, AUTH PLAIN/LOGIN,
+MAIL, RCPT, DATA, RSET, NOOP and QUIT), accepts any credentials and discards
+the messages. It runs in a process of its own so that it neither competes with
+the client for the GIL nor shows up in the client's memory measurements, and
+counts connections, logins, messages and bytes received."""
+import datetime
+import logging
+import multiprocessing
+import os
+import socketserver
+import ssl
+import tempfile
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+logger = logging.getLogger(__name__)
+
+_COUNTERS = ("connections", "logins", "messages", "bytes")
+
+
+def _self_signed_context(directory: str) -> ssl.SSLContext:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_file = os.path.join(directory, "key.pem")
+    cert_file = os.path.join(directory, "cert.pem")
+    with open(key_file, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption(),
+            )
+        )
+    with open(cert_file, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.tls = False
+        self.counters = self.server.counters
+        self._count("connections")
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        counter = self.counters[name]
+        with counter.get_lock():
+            counter.value += amount
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        self._reply("220 localhost ESMTP stub")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode("ascii", "replace").strip().partition(" ")
+            command = command.upper()
+            if command in ("EHLO", "HELO"):
+                self._reply("250-localhost")
+                self._reply("250-8BITMIME")
+                self._reply("250 AUTH PLAIN LOGIN" if self.tls else "250 STARTTLS")
+            elif command == "STARTTLS":
+                self._reply("220 Ready to start TLS")
+                self.request = self.server.context.wrap_socket(self.request, server_side=True)
+                self.rfile = self.request.makefile("rb")
+                self.wfile = self.request.makefile("wb")
+                self.tls = True
+            elif command == "AUTH":
+                if argument.upper().startswith("LOGIN"):
+                    self._reply("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self._reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                self._count("logins")
+                self._reply("235 Authentication successful")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                self._count("bytes", self._receive_data())
+                self._count("messages")
+                self._reply("250 Queued")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+    def _receive_data(self) -> int:
+        """Discard the message, reading in large blocks up to the terminating dot"""
+        size = 0
+        tail = b"\r\n"
+        while True:
+            block = self.rfile.read1(2**16)
+            if not block:
+                return size
+            size += len(block)
+            if (tail + block).endswith(b"\r\n.\r\n"):
+                return size
+            tail = (tail + block)[-4:]
+
+
+class _ThreadingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _serve(counters: dict, port, ready) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        server = _ThreadingSMTPServer(("127.0.0.1", 0), _SMTPHandler)
+        server.context = _self_signed_context(directory)
+        server.counters = counters
+        port.value = server.server_address[1]
+        ready.set()
+        server.serve_forever()
+
+
+class StubSMTPServer:
+    """Start the SMTP server stand-in in a child process on a free port.
+
+    Attributes:
+        port (int): The port the server listens on
+    """
+
+    def __init__(self) -> None:
+        self._counters = {name: multiprocessing.Value("q", 0) for name in _COUNTERS}
+        port = multiprocessing.Value("i", 0)
+        ready = multiprocessing.Event()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self._counters, port, ready), daemon=True
+        )
+        self._process.start()
+        if not ready.wait(30):
+            self.close()
+            raise RuntimeError("The SMTP stub server did not start")
+        self.port = port.value
+
+    def counters(self) -> dict:
+        """Returns the connections, logins, messages and bytes received so far"""
+        return {name: counter.value for name, counter in self._counters.items()}
+
+    def reset(self) -> None:
+        """Set all counters to zero"""
+        for counter in self._counters.values():
+            with counter.get_lock():
+                counter.value = 0
+
+    def close(self) -> None:
+        self._process.terminate()
+        self._process.join()
@@ -4,6 +4,7 @@ from .shared import *
 from .send_email import *
 from .file_transfer import *
 from .templating import *
+from .mail_merge import *
 
 if sys.version_info[:2] >= (3, 9):
     # TODO: Import directly (no need for conditional) when `python_requires = >= 3.9`
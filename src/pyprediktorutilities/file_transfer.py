@@ -1,40 +1,262 @@
 from pydantic import validate_call
+from typing import Any, Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from functools import partial
+import hashlib
+import io
+import json
 import os
 import logging
+import posixpath
+import stat
+import threading
+import zlib
 import paramiko
-from pyprediktorutilities.shared import validate_file
+from pyprediktorutilities.shared import validate_file, validate_folder
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# Channel window and packet size used by the tuned transfer mode. They set how
+# much the server may send before waiting for us, so they speed up downloads on
+# high-latency links. Uploads are limited by the server's window, not ours
+TUNED_WINDOW_SIZE = 2**27
+TUNED_MAX_PACKET_SIZE = 2**16
+
+
+class SFTPUploadError(Exception):
+    """Raised when one or more files in a batch could not be transferred. The
+    rest of the batch is still transferred.
+
+    Attributes:
+        failed (dict): The files that failed, mapped to their exception
+        transferred (list): The destination paths of the files that succeeded
+    """
+
+    def __init__(self, failed: dict, transferred: list):
+        self.failed = failed
+        self.transferred = transferred
+        super().__init__(
+            f"{len(failed)} of {len(failed) + len(transferred)} files failed: "
+            + ", ".join(f"{file} ({error})" for file, error in failed.items())
+        )
+
+
+class _Manifest:
+    """A local JSON file recording the checksum of every file uploaded, keyed by
+    remote path, so unchanged files can be recognised regardless of timestamps"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+
+    @staticmethod
+    def checksum(file: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def get(self, remote_path: str) -> str:
+        with self._lock:
+            return self._entries.get(remote_path)
+
+    def record(self, remote_path: str, checksum: str) -> None:
+        with self._lock:
+            self._entries[remote_path] = checksum
+
+    def save(self) -> None:
+        with self._lock:
+            with open(f"{self.path}.tmp", "w") as f:
+                json.dump(self._entries, f, indent=2, sort_keys=True)
+            os.replace(f"{self.path}.tmp", self.path)
+
+
+class _IterableReader:
+    """A readable file object over an iterable of bytes (or str) chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class _GzipReader(_IterableReader):
+    """A readable file object returning the gzip compressed content of another"""
+
+    def __init__(self, raw):
+        super().__init__(self._compress(raw))
+
+    @staticmethod
+    def _compress(raw):
+        compressor = zlib.compressobj(wbits=31)
+        for data in iter(lambda: raw.read(2**16), b""):
+            if isinstance(data, str):
+                if not data:
+                    break
+                data = data.encode("utf-8")
+            yield compressor.compress(data)
+        yield compressor.flush()
+
 
 class SFTPClient:
     """An SFTP client to upload files to a remote server
-    
+
+    By default every call opens and closes its own SSH connection. Use the
+    client as a context manager (or call connect() and close()) to keep one
+    connection alive and reuse it across calls. A dropped connection is
+    re-established on the next call, and an idle one is closed after
+    idle_timeout seconds and reopened when needed.
+
     Args:
         server (AnyUrl): The server address
         username (str): The username
         password (str): The password
         port (int): The port number
-        
+        keepalive (int): Seconds between keepalive packets on the connection,
+            0 to disable. Defaults to 30
+        idle_timeout (float): Seconds a persistent connection may be idle
+            before it is closed, 0 to keep it open. Defaults to 300
+        tuned (bool): Open SFTP channels with TUNED_WINDOW_SIZE and
+            TUNED_MAX_PACKET_SIZE instead of the paramiko defaults, for faster
+            downloads on high-latency links. Uploads are not affected. Defaults to False
+        window_size (int): Explicit SFTP channel window size, overrides tuned
+        max_packet_size (int): Explicit SFTP channel packet size, overrides tuned
+        known_hosts (str): Optional known_hosts file to load in addition to the
+            system host keys
+
     Returns:
         Object: SFTPClient object
+
+    Examples:
+        >>> with SFTPClient(server, username, password, 22) as client:
+        ...     client.upload(["report1.xlsx"], "/reports")
+        ...     client.upload(["report2.xlsx"], "/reports")
     """
     @validate_call
-    def __init__(self, server: str, username: str, password: str, port: int) -> object:
+    def __init__(
+        self,
+        server: str,
+        username: str,
+        password: str,
+        port: int,
+        keepalive: int = 30,
+        idle_timeout: float = 300,
+        tuned: bool = False,
+        window_size: int = None,
+        max_packet_size: int = None,
+        known_hosts: str = None,
+    ) -> object:
         self.server = server
         self.username = username
         self.password = password
         self.port = port
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.window_size = window_size or (TUNED_WINDOW_SIZE if tuned else None)
+        self.max_packet_size = max_packet_size or (TUNED_MAX_PACKET_SIZE if tuned else None)
+        self.known_hosts = known_hosts
+        self._ssh = None
+        self._persistent = False
+        self._active = 0
+        self._idle_timer = None
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connect(self) -> None:
+        """Open a persistent connection that is reused by later calls until close()"""
+        with self._lock:
+            self._persistent = True
+            self._ensure_connected()
+            self._start_idle_timer()
+
+    def close(self) -> None:
+        """Close the persistent connection, later calls use their own connections"""
+        with self._lock:
+            self._persistent = False
+            self._cancel_idle_timer()
+            self._disconnect()
 
     @validate_call
-    def upload(self, files: list[str], remote_directory: str):
+    def upload(
+        self,
+        files: list[str],
+        remote_directory: str,
+        max_workers: int = 1,
+        progress: Callable[[str, int, int], None] = None,
+        resume: bool = False,
+        skip_unchanged: bool = False,
+        manifest: str = None,
+        atomic: bool = False,
+    ) -> list[str]:
         """Upload the files to the remote directory, create the directory
         recursively if it does not exist (and the remote server allows it)
 
+        With max_workers above 1 the files are spread over that many SFTP
+        channels multiplexed on the same SSH connection. A file that fails does
+        not abort the batch, the failures are raised together at the end.
+
+        With resume, a remote file that is shorter than the local one is assumed
+        to be an interrupted upload and only the missing part is sent. With
+        skip_unchanged, files whose remote size and modification time match the
+        local file are skipped. The remote modification time is set to the local
+        one after each upload so the next run can compare them. Pass a manifest
+        file to compare SHA-256 checksums recorded by earlier runs instead of
+        modification times.
+
+        With atomic, every file is uploaded to a hidden temporary name next to
+        its destination. Only when the whole batch has been uploaded are the
+        files renamed to their final names with posix_rename, so consumers never
+        see half-written files and see the batch appear at once. If any file
+        fails, none are published. Combined with resume, an interrupted atomic
+        upload continues from its temporary file. Requires a server supporting
+        the posix-rename@openssh.com extension.
+
         Args:
-            files (list[str]): _description_
-            remote_directory (str): _description_
+            files (list[str]): The paths of the local files to upload
+            remote_directory (str): The remote directory to upload to
+            max_workers (int): The number of files to upload concurrently
+            progress (callable): Called as progress(file, bytes_sent, total_bytes)
+                while each file is uploaded
+            resume (bool): Continue partially uploaded files. Defaults to False
+            skip_unchanged (bool): Skip files that are unchanged on the remote
+                side. Defaults to False
+            manifest (str): Optional path of a local JSON checksum manifest used
+                by skip_unchanged, created if it does not exist
+            atomic (bool): Upload to temporary names and publish the batch at
+                once. Defaults to False
+
+        Raises:
+            FileNotFoundError: If there are no files or a file does not exist
+            SFTPUploadError: If one or more files could not be uploaded
+
+        Returns:
+            list[str]: The remote paths of the uploaded files, without skipped files
         """
         
         if not files:
@@ -42,28 +264,686 @@ class SFTPClient:
         
         for file in files:
             validate_file(file)
+
+        checksums = _Manifest(manifest) if manifest is not None else None
+        transfer = partial(
+            self._put, resume=resume, skip_unchanged=skip_unchanged, manifest=checksums, atomic=atomic
+        )
+        run_batch = self._run_atomic_batch if atomic else self._run_batch
         
-        with paramiko.SSHClient() as ssh:
-            ssh.load_system_host_keys()
-            ssh.connect(
-                self.server,
-                port=self.port,
-                username=self.username,
-                password=self.password,
+        with self._connection() as ssh:
+            with self._open_sftp(ssh) as sftp:
+                self._ensure_remote_directory(sftp, remote_directory)
+
+            jobs = [(file, f"{remote_directory}/{os.path.basename(file)}") for file in files]
+            try:
+                return run_batch(ssh, jobs, transfer, max_workers, progress)
+            finally:
+                if checksums is not None:
+                    checksums.save()
+
+    @validate_call
+    def upload_fileobj(
+        self,
+        source: Any,
+        remote_path: str,
+        compress: bool = False,
+        progress: Callable[[str, int, int], None] = None,
+        atomic: bool = False,
+    ) -> str:
+        """Upload data that is already in memory or being generated, without
+        writing it to a local file first. The remote directory is created if it
+        does not exist.
+
+        Args:
+            source: The content to upload. Either bytes, a str (uploaded as UTF-8
+                text, use upload() for paths), a readable binary file-like object
+                or an iterable of bytes chunks
+            remote_path (str): The remote path to write to
+            compress (bool): Gzip the content on the fly. Defaults to False
+            progress (callable): Called as progress(remote_path, bytes_sent, total_bytes),
+                where total_bytes is 0 if it is not known up front
+            atomic (bool): Upload to a temporary name and rename it to remote_path
+                once complete. Defaults to False
+
+        Raises:
+            TypeError: If the source is not of a supported type
+
+        Returns:
+            str: The remote path of the uploaded file
+        """
+        reader, size = self._reader(source)
+        if compress:
+            reader, size = _GzipReader(reader), 0
+
+        callback = None
+        if progress is not None:
+            callback = lambda done, total: progress(remote_path, done, total)  # noqa: E731
+
+        with self._connection() as ssh:
+            with self._open_sftp(ssh) as sftp:
+                directory = posixpath.dirname(remote_path)
+                if directory:
+                    self._ensure_remote_directory(sftp, directory)
+                target = self._temporary_path(remote_path) if atomic else remote_path
+                sftp.putfo(reader, target, file_size=size, callback=callback)
+                if atomic:
+                    sftp.posix_rename(target, remote_path)
+        logging.info(f"Uploaded data to {remote_path} successfully!")
+        return remote_path
+
+    @staticmethod
+    def _reader(source: Any) -> tuple:
+        """Returns a readable file object for the source and its size, if known"""
+        if isinstance(source, str):
+            source = source.encode("utf-8")
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return io.BytesIO(source), len(source)
+        if hasattr(source, "read"):
+            return source, 0
+        if hasattr(source, "__iter__"):
+            return _IterableReader(source), 0
+        errormsg = f"Cannot upload an object of type {type(source).__name__}"
+        logging.error(errormsg)
+        raise TypeError(errormsg)
+
+    @validate_call
+    def download(
+        self,
+        remote_files: list[str],
+        local_directory: str,
+        max_workers: int = 1,
+        progress: Callable[[str, int, int], None] = None,
+    ) -> list[str]:
+        """Download remote files into a local directory
+
+        Args:
+            remote_files (list[str]): The paths of the remote files to download
+            local_directory (str): The existing local directory to download to
+            max_workers (int): The number of files to download concurrently
+            progress (callable): Called as progress(remote_file, bytes_received, total_bytes)
+
+        Raises:
+            FileNotFoundError: If there are no files or the local directory does not exist
+            SFTPUploadError: If one or more files could not be downloaded
+
+        Returns:
+            list[str]: The local paths of the downloaded files
+        """
+        if not remote_files:
+            raise FileNotFoundError("No files to download")
+        validate_folder(local_directory)
+
+        jobs = [
+            (remote_file, os.path.join(local_directory, posixpath.basename(remote_file)))
+            for remote_file in remote_files
+        ]
+        with self._connection() as ssh:
+            return self._run_batch(ssh, jobs, self._get, max_workers, progress)
+
+    @validate_call
+    def sync_up(
+        self,
+        local_directory: str,
+        remote_directory: str,
+        include: list[str] = None,
+        exclude: list[str] = None,
+        delete: bool = False,
+        max_workers: int = 4,
+        progress: Callable[[str, int, int], None] = None,
+        atomic: bool = False,
+    ) -> list[str]:
+        """Recursively synchronise a local directory to a remote directory, like
+        rsync. Only files that are missing remotely or differ in size or
+        modification time are uploaded. The remote tree is listed with one
+        listdir_attr per directory, several directories at a time.
+
+        Args:
+            local_directory (str): The local directory to upload from
+            remote_directory (str): The remote directory to upload to, created if missing
+            include (list[str]): Only sync files matching one of these globs
+            exclude (list[str]): Do not sync files matching one of these globs
+            delete (bool): Delete remote files and directories that do not exist
+                locally. Excluded files are left alone. Defaults to False
+            max_workers (int): The number of directories listed and files uploaded
+                concurrently
+            progress (callable): Called as progress(file, bytes_sent, total_bytes)
+            atomic (bool): Upload to temporary names and publish all changed
+                files at once, see upload(). Defaults to False
+
+        Raises:
+            FileNotFoundError: If the local directory does not exist
+            SFTPUploadError: If one or more files could not be uploaded
+
+        Returns:
+            list[str]: The remote paths of the uploaded files
+        """
+        validate_folder(local_directory)
+        local_files, local_directories = self._walk_local(local_directory)
+        local_files = {p: a for p, a in local_files.items() if self._matches(p, include, exclude)}
+
+        with self._connection() as ssh:
+            with self._open_sftp(ssh) as sftp:
+                self._ensure_remote_directory(sftp, remote_directory)
+            remote_files, remote_directories = self._walk_remote(ssh, remote_directory, max_workers)
+            remote_files = {p: a for p, a in remote_files.items() if not self._is_temporary(p)}
+
+            jobs = [
+                (os.path.join(local_directory, *path.split("/")), posixpath.join(remote_directory, path))
+                for path, attr in sorted(local_files.items())
+                if path not in remote_files or not self._same(attr, remote_files[path])
+            ]
+            needed = {posixpath.dirname(path) for path in local_files} - {""}
+            with self._open_sftp(ssh) as sftp:
+                for directory in sorted(needed - remote_directories):
+                    self._ensure_remote_directory(sftp, posixpath.join(remote_directory, directory))
+
+                if delete:
+                    for path in sorted(remote_files):
+                        if path not in local_files and self._matches(path, include, exclude):
+                            sftp.remove(posixpath.join(remote_directory, path))
+                            logging.info(f"Deleted {remote_directory}/{path}")
+                    for path in sorted(remote_directories - local_directories, reverse=True):
+                        try:
+                            sftp.rmdir(posixpath.join(remote_directory, path))
+                            logging.info(f"Deleted {remote_directory}/{path}")
+                        except IOError:
+                            # Still holds excluded files
+                            pass
+
+            transfer = partial(self._put, preserve_mtime=True, atomic=atomic)
+            run_batch = self._run_atomic_batch if atomic else self._run_batch
+            return run_batch(ssh, jobs, transfer, max_workers, progress)
+
+    @validate_call
+    def sync_down(
+        self,
+        remote_directory: str,
+        local_directory: str,
+        include: list[str] = None,
+        exclude: list[str] = None,
+        delete: bool = False,
+        max_workers: int = 4,
+        progress: Callable[[str, int, int], None] = None,
+    ) -> list[str]:
+        """Recursively synchronise a remote directory to a local directory, like
+        rsync. Only files that are missing locally or differ in size or
+        modification time are downloaded.
+
+        Args:
+            remote_directory (str): The remote directory to download from
+            local_directory (str): The local directory to download to, created if missing
+            include (list[str]): Only sync files matching one of these globs
+            exclude (list[str]): Do not sync files matching one of these globs
+            delete (bool): Delete local files and directories that do not exist
+                remotely. Excluded files are left alone. Defaults to False
+            max_workers (int): The number of directories listed and files
+                downloaded concurrently
+            progress (callable): Called as progress(remote_file, bytes_received, total_bytes)
+
+        Raises:
+            FileNotFoundError: If the remote directory does not exist
+            SFTPUploadError: If one or more files could not be downloaded
+
+        Returns:
+            list[str]: The local paths of the downloaded files
+        """
+        os.makedirs(local_directory, exist_ok=True)
+        local_files, local_directories = self._walk_local(local_directory)
+
+        with self._connection() as ssh:
+            remote_files, remote_directories = self._walk_remote(ssh, remote_directory, max_workers)
+            remote_files = {p: a for p, a in remote_files.items() if self._matches(p, include, exclude)}
+
+            for directory in sorted({posixpath.dirname(path) for path in remote_files} - {""}):
+                os.makedirs(os.path.join(local_directory, *directory.split("/")), exist_ok=True)
+
+            if delete:
+                for path in sorted(local_files):
+                    if path not in remote_files and self._matches(path, include, exclude):
+                        os.remove(os.path.join(local_directory, *path.split("/")))
+                        logging.info(f"Deleted {local_directory}/{path}")
+                for path in sorted(local_directories - remote_directories, reverse=True):
+                    try:
+                        os.rmdir(os.path.join(local_directory, *path.split("/")))
+                        logging.info(f"Deleted {local_directory}/{path}")
+                    except OSError:
+                        # Still holds excluded files
+                        pass
+
+            jobs, attrs = [], {}
+            for path, attr in sorted(remote_files.items()):
+                if path in local_files and self._same(local_files[path], attr):
+                    continue
+                remote_path = posixpath.join(remote_directory, path)
+                jobs.append((remote_path, os.path.join(local_directory, *path.split("/"))))
+                attrs[remote_path] = attr
+
+            def transfer(sftp, remote_path, file, callback):
+                return self._get(sftp, remote_path, file, callback, attrs[remote_path])
+
+            return self._run_batch(ssh, jobs, transfer, max_workers, progress)
+
+    @validate_call
+    def upload_large(
+        self,
+        file: str,
+        remote_directory: str,
+        chunk_size: int = 2**26,
+        max_workers: int = 4,
+        progress: Callable[[str, int, int], None] = None,
+        atomic: bool = False,
+    ) -> str:
+        """Upload a single large file as concurrent chunks. Each worker writes its
+        chunks at their offset in the remote file through its own SFTP channel,
+        with pipelined write requests.
+
+        Args:
+            file (str): The path of the local file to upload
+            remote_directory (str): The remote directory to upload to
+            chunk_size (int): The number of bytes per chunk. Defaults to 64 MiB
+            max_workers (int): The number of chunks to upload concurrently
+            progress (callable): Called as progress(file, bytes_sent, total_bytes)
+            atomic (bool): Upload to a temporary name and rename it once the size
+                is verified. Defaults to False
+
+        Raises:
+            FileNotFoundError: If the file does not exist
+            SFTPUploadError: If a chunk could not be uploaded
+            IOError: If the remote file does not have the expected size afterwards
+
+        Returns:
+            str: The remote path of the uploaded file
+        """
+        validate_file(file)
+        size = os.path.getsize(file)
+        remote_path = f"{remote_directory}/{os.path.basename(file)}"
+        target = self._temporary_path(remote_path) if atomic else remote_path
+        sent = 0
+        lock = threading.Lock()
+
+        def write_chunk(sftp, offset, target, callback) -> int:
+            nonlocal sent
+            with open(file, "rb") as local, sftp.open(target, "r+b") as remote:
+                local.seek(offset)
+                remote.seek(offset)
+                remote.set_pipelined(True)
+                remaining = min(chunk_size, size - offset)
+                while remaining > 0:
+                    data = local.read(min(2**20, remaining))
+                    remote.write(data)
+                    remaining -= len(data)
+                    if progress is not None:
+                        with lock:
+                            sent += len(data)
+                            progress(file, sent, size)
+            return offset
+
+        with self._connection() as ssh:
+            with self._open_sftp(ssh) as sftp:
+                self._ensure_remote_directory(sftp, remote_directory)
+                # Create or truncate the file before the chunks are written into it
+                sftp.open(target, "wb").close()
+
+            jobs = [(offset, target) for offset in range(0, size, chunk_size)]
+            try:
+                self._run_batch(ssh, jobs, write_chunk, max_workers)
+            except SFTPUploadError as e:
+                raise SFTPUploadError({file: next(iter(e.failed.values()))}, [])
+
+            with self._open_sftp(ssh) as sftp:
+                remote_size = sftp.stat(target).st_size
+                if remote_size != size:
+                    errormsg = f"Size mismatch for {target}: {remote_size} != {size}"
+                    logging.error(errormsg)
+                    raise IOError(errormsg)
+                if atomic:
+                    sftp.posix_rename(target, remote_path)
+        logging.info(f"Uploaded {file} to {remote_path} in {len(jobs)} chunks successfully!")
+        return remote_path
+
+    def _open_connection(self) -> paramiko.SSHClient:
+        ssh = paramiko.SSHClient()
+        ssh.load_system_host_keys()
+        if self.known_hosts is not None:
+            ssh.load_host_keys(self.known_hosts)
+        ssh.connect(
+            self.server,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+        )
+        if self.keepalive:
+            ssh.get_transport().set_keepalive(self.keepalive)
+        return ssh
+
+    def _ensure_connected(self) -> paramiko.SSHClient:
+        if self._ssh is not None:
+            transport = self._ssh.get_transport()
+            if transport is None or not transport.is_active():
+                logging.warning(f"Connection to {self.server} was dropped, reconnecting")
+                self._disconnect()
+        if self._ssh is None:
+            self._ssh = self._open_connection()
+        return self._ssh
+
+    def _disconnect(self) -> None:
+        if self._ssh is not None:
+            self._ssh.close()
+            self._ssh = None
+
+    def _start_idle_timer(self) -> None:
+        self._cancel_idle_timer()
+        if self._persistent and self.idle_timeout > 0:
+            self._idle_timer = threading.Timer(self.idle_timeout, self._close_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _cancel_idle_timer(self) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _close_idle(self) -> None:
+        with self._lock:
+            if self._active == 0 and self._ssh is not None:
+                logging.info(f"Closing idle connection to {self.server}")
+                self._disconnect()
+
+    @contextmanager
+    def _connection(self):
+        """Yields the persistent connection if there is one, otherwise a
+        connection that is closed again afterwards"""
+        if not self._persistent:
+            with self._open_connection() as ssh:
+                yield ssh
+            return
+
+        with self._lock:
+            self._cancel_idle_timer()
+            ssh = self._ensure_connected()
+            self._active += 1
+        try:
+            yield ssh
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    self._start_idle_timer()
+
+    def _open_sftp(self, ssh: paramiko.SSHClient) -> paramiko.SFTPClient:
+        if self.window_size is None and self.max_packet_size is None:
+            return ssh.open_sftp()
+        return paramiko.SFTPClient.from_transport(
+            ssh.get_transport(),
+            window_size=self.window_size,
+            max_packet_size=self.max_packet_size,
+        )
+
+    def _ensure_remote_directory(self, sftp: paramiko.SFTPClient, remote_directory: str) -> None:
+        # Check if remote directory exists or create it, including missing parents
+        try:
+            sftp.stat(remote_directory)
+        except FileNotFoundError:
+            parent = posixpath.dirname(remote_directory.rstrip("/"))
+            if parent and parent != remote_directory:
+                self._ensure_remote_directory(sftp, parent)
+            sftp.mkdir(remote_directory)
+
+    def _put(
+        self,
+        sftp: paramiko.SFTPClient,
+        file: str,
+        remote_path: str,
+        callback,
+        resume: bool = False,
+        skip_unchanged: bool = False,
+        manifest: _Manifest = None,
+        preserve_mtime: bool = False,
+        atomic: bool = False,
+    ) -> str:
+        """Upload a single file, returns None if it was skipped. Both put and
+        _append confirm the remote size afterwards. In atomic mode the file is
+        written to its temporary path and left for _publish to rename"""
+        target = self._temporary_path(remote_path) if atomic else remote_path
+        remote = partial_upload = None
+        if resume or skip_unchanged or preserve_mtime:
+            local = os.stat(file)
+        if skip_unchanged:
+            remote = self._remote_stat(sftp, remote_path)
+        if resume:
+            if skip_unchanged and not atomic:
+                partial_upload = remote
+            else:
+                partial_upload = self._remote_stat(sftp, target)
+
+        checksum = None
+        if skip_unchanged and manifest is not None:
+            checksum = manifest.checksum(file)
+        if skip_unchanged and remote is not None and remote.st_size == local.st_size:
+            if checksum is not None:
+                unchanged = manifest.get(remote_path) == checksum
+            else:
+                unchanged = int(remote.st_mtime) == int(local.st_mtime)
+            if unchanged:
+                logging.info(f"Skipped {file}, {remote_path} is unchanged")
+                return None
+
+        if partial_upload is not None and 0 < partial_upload.st_size < local.st_size:
+            self._append(sftp, file, target, partial_upload.st_size, local.st_size, callback)
+            logging.info(
+                f"Resumed {file} to {target} from byte {partial_upload.st_size} successfully!"
+            )
+        else:
+            sftp.put(file, target, callback=callback)
+            logging.info(
+                f"Uploaded {file} to {target} successfully!"
             )
 
-            with ssh.open_sftp() as sftp:
-                # Check if remote directory exists or create it
+        if skip_unchanged or preserve_mtime:
+            sftp.utime(target, (local.st_atime, local.st_mtime))
+        if checksum is not None:
+            manifest.record(remote_path, checksum)
+        return remote_path
+
+    @staticmethod
+    def _is_temporary(path: str) -> bool:
+        name = posixpath.basename(path)
+        return name.startswith(".") and name.endswith(".part")
+
+    @staticmethod
+    def _temporary_path(remote_path: str) -> str:
+        """Returns the hidden name a file is uploaded to before it is renamed in
+        atomic mode. The name is stable, so an interrupted upload can be resumed"""
+        directory, name = posixpath.split(remote_path)
+        return posixpath.join(directory, f".{name}.part")
+
+    def _publish(self, ssh: paramiko.SSHClient, remote_paths: list[str]) -> None:
+        """Rename uploaded temporary files to their final names, one right after
+        the other so the batch becomes visible at once"""
+        with self._open_sftp(ssh) as sftp:
+            for remote_path in remote_paths:
+                sftp.posix_rename(self._temporary_path(remote_path), remote_path)
+                logging.info(f"Published {remote_path}")
+
+    def _discard(self, ssh: paramiko.SSHClient, remote_paths: list[str]) -> None:
+        """Remove the temporary files of an atomic batch that failed"""
+        with self._open_sftp(ssh) as sftp:
+            for remote_path in remote_paths:
                 try:
-                    sftp.stat(remote_directory)
-                except FileNotFoundError:
-                    sftp.mkdir(remote_directory)
-
-                # Upload each file
-                for file in files:
-                    remote_path = f"{remote_directory}/{os.path.basename(file)}"
-                    sftp.put(file, remote_path)
-                    logging.info(
-                        f"Uploaded {file} to {remote_path} successfully!"
-                    )
+                    sftp.remove(self._temporary_path(remote_path))
+                except IOError as e:
+                    logging.warning(f"Could not remove {self._temporary_path(remote_path)}: {e}")
+
+    def _run_atomic_batch(
+        self,
+        ssh: paramiko.SSHClient,
+        jobs: list[tuple[str, str]],
+        transfer: Callable,
+        max_workers: int,
+        progress: Callable = None,
+    ) -> list[str]:
+        """Run an upload batch to temporary names and publish it only if every
+        file succeeded. Otherwise nothing becomes visible"""
+        try:
+            transferred = self._run_batch(ssh, jobs, transfer, max_workers, progress)
+        except SFTPUploadError as e:
+            self._discard(ssh, e.transferred)
+            raise SFTPUploadError(e.failed, [])
+        self._publish(ssh, transferred)
+        return transferred
+
+    def _append(
+        self, sftp: paramiko.SFTPClient, file: str, remote_path: str, offset: int, size: int, callback
+    ) -> None:
+        """Send the part of the file after offset to the end of the remote file"""
+        with open(file, "rb") as local, sftp.open(remote_path, "r+b") as remote:
+            local.seek(offset)
+            remote.seek(offset)
+            remote.set_pipelined(True)
+            sent = offset
+            for data in iter(lambda: local.read(32768), b""):
+                remote.write(data)
+                sent += len(data)
+                if callback is not None:
+                    callback(sent, size)
+        remote_size = sftp.stat(remote_path).st_size
+        if remote_size != size:
+            raise IOError(f"Size mismatch for {remote_path}: {remote_size} != {size}")
+
+    @staticmethod
+    def _remote_stat(sftp: paramiko.SFTPClient, remote_path: str) -> paramiko.SFTPAttributes:
+        try:
+            return sftp.stat(remote_path)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _thread_channels(self, ssh: paramiko.SSHClient):
+        """Yields a function returning an SFTP channel owned by the calling
+        thread. All channels are closed afterwards"""
+        local = threading.local()
+        channels = []
+        lock = threading.Lock()
+
+        def channel() -> paramiko.SFTPClient:
+            sftp = getattr(local, "sftp", None)
+            if sftp is None:
+                sftp = local.sftp = self._open_sftp(ssh)
+                with lock:
+                    channels.append(sftp)
+            return sftp
+
+        try:
+            yield channel
+        finally:
+            for sftp in channels:
+                sftp.close()
+
+    def _walk_remote(
+        self, ssh: paramiko.SSHClient, remote_directory: str, max_workers: int
+    ) -> tuple[dict, set]:
+        """List a remote tree with one listdir_attr per directory, listing
+        max_workers directories concurrently
+
+        Returns:
+            tuple: The files as {relative path: SFTPAttributes} and the set of
+                relative directory paths
+        """
+        files, directories = {}, set()
+
+        def list_directory(channel, relative: str) -> list[str]:
+            subdirectories = []
+            for attr in channel().listdir_attr(posixpath.join(remote_directory, relative)):
+                path = posixpath.join(relative, attr.filename) if relative else attr.filename
+                if stat.S_ISDIR(attr.st_mode or 0):
+                    subdirectories.append(path)
+                else:
+                    files[path] = attr
+            return subdirectories
+
+        with self._thread_channels(ssh) as channel:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pending = {executor.submit(list_directory, channel, "")}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for path in future.result():
+                            directories.add(path)
+                            pending.add(executor.submit(list_directory, channel, path))
+        return files, directories
+
+    @staticmethod
+    def _walk_local(local_directory: str) -> tuple[dict, set]:
+        """List a local tree the same way as _walk_remote, with os.stat_result values"""
+        files, directories = {}, set()
+        for root, dirnames, filenames in os.walk(local_directory):
+            relative = os.path.relpath(root, local_directory)
+            relative = "" if relative == "." else relative.replace(os.sep, "/")
+            for name in dirnames:
+                directories.add(posixpath.join(relative, name) if relative else name)
+            for name in filenames:
+                path = posixpath.join(relative, name) if relative else name
+                files[path] = os.stat(os.path.join(root, name))
+        return files, directories
+
+    @staticmethod
+    def _matches(path: str, include: list[str] = None, exclude: list[str] = None) -> bool:
+        """Check a relative path against include and exclude globs. A glob matches
+        either the whole relative path or the file name"""
+        name = posixpath.basename(path)
+
+        def any_match(patterns):
+            return any(fnmatch(path, p) or fnmatch(name, p) for p in patterns)
+
+        if include and not any_match(include):
+            return False
+        return not (exclude and any_match(exclude))
+
+    @staticmethod
+    def _same(local: os.stat_result, remote: paramiko.SFTPAttributes) -> bool:
+        return local.st_size == remote.st_size and int(local.st_mtime) == int(remote.st_mtime or 0)
+
+    def _get(self, sftp: paramiko.SFTPClient, remote_path: str, file: str, callback, attr=None) -> str:
+        sftp.get(remote_path, file, callback=callback)
+        if attr is not None:
+            os.utime(file, (attr.st_atime or attr.st_mtime, attr.st_mtime))
+        logging.info(
+            f"Downloaded {remote_path} to {file} successfully!"
+        )
+        return file
+
+    def _run_batch(
+        self,
+        ssh: paramiko.SSHClient,
+        jobs: list[tuple[str, str]],
+        transfer: Callable,
+        max_workers: int,
+        progress: Callable = None,
+    ) -> list[str]:
+        """Run transfer(sftp, source, destination, callback) for every job, spread
+        over max_workers threads that each own an SFTP channel on the connection"""
+
+        def run(channel, source: str, destination: str) -> str:
+            callback = None
+            if progress is not None:
+                callback = lambda done, total: progress(source, done, total)  # noqa: E731
+            return transfer(channel(), source, destination, callback)
+
+        results, failed = {}, {}
+        with self._thread_channels(ssh) as channel:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(run, channel, *job): job[0] for job in jobs}
+                for future in as_completed(futures):
+                    source = futures[future]
+                    try:
+                        results[source] = future.result()
+                    except Exception as e:
+                        logging.error(f"Failed to transfer {source}: {e}")
+                        failed[source] = e
 
+        # Keep the order of the jobs
+        transferred = [results[source] for source, _ in jobs if results.get(source) is not None]
+        if failed:
+            raise SFTPUploadError(failed, transferred)
+        return transferred
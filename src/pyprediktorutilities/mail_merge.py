@@ -0,0 +1,149 @@
+from pydantic import validate_call, EmailStr
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import logging
+import time
+from pyprediktorutilities.send_email import SendEmail, EmailQueue
+from pyprediktorutilities.templating import Templating
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class MailMerge:
+    """Send a personalised email, rendered from one template, to many recipients.
+
+    The body template and the subject are compiled once. Bodies are rendered on
+    a few threads and handed to an EmailQueue as they are ready, so rendering
+    overlaps with delivery over a few persistent SMTP connections. Rendering is
+    CPU bound, so the threads do not make rendering itself faster than one
+    thread would. The attachments shared by all emails are kept in encoded form
+    once they are reused, rather than read and encoded for every email.
+
+    Args:
+        templating (Templating): The templating object holding the template
+        sender (SendEmail): Provides the SMTP server and credentials
+        template (str): The file name of the body template
+        subject (str): The subject, itself a template rendered with the same data
+        from_email (email address): The sender email address
+        connections (int): The number of SMTP connections to send over. Defaults to 4
+        render_workers (int): The number of threads rendering bodies ahead of
+            delivery. Defaults to 4
+        retries (int): The number of retries of a transient delivery failure. Defaults to 3
+        backoff (float): Seconds before the first retry, doubled for every
+            following retry. Defaults to 1
+
+    Raises:
+        FileNotFoundError: If the template does not exist
+
+    Examples:
+        >>> merge = MailMerge(Templating("templates"), SendEmail(server, port, username, password),
+        ...     "report.txt", "Daily report for {{ plant }}", "no-reply@nowhere.com")
+        >>> report = merge.send([{"email": "someone@somewhere.com", "plant": "Plant 1"}], files=["report.pdf"])
+        >>> report["sent"], report["messages_per_second"]
+    """
+
+    @validate_call(config=dict(arbitrary_types_allowed=True))
+    def __init__(
+        self,
+        templating: Templating,
+        sender: SendEmail,
+        template: str,
+        subject: str,
+        from_email: EmailStr,
+        connections: int = 4,
+        render_workers: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+    ) -> None:
+        self.templating = templating
+        self.sender = sender
+        self.from_email = str(from_email)
+        self.connections = connections
+        self.render_workers = render_workers
+        self.retries = retries
+        self.backoff = backoff
+        self._template = templating.load_template(template)
+        # Subjects are plain text, so they are not escaped like HTML bodies
+        self._subject = templating.env.overlay(autoescape=False).from_string(subject)
+
+    @validate_call
+    def send(self, recipients: list[dict], files: list = [], to_field: str = "email") -> dict:
+        """Render and send one email per entry in recipients
+
+        Args:
+            recipients (list[dict]): The template data for each email. The
+                to_field of each entry holds the email address, or a list of
+                addresses, to send it to
+            files (list, optional): Paths to files attached to every email. Defaults to [].
+            to_field (str): The key holding the addresses. Defaults to "email"
+
+        Returns:
+            dict: "sent" and "failed" counts, "seconds" taken, "messages_per_second"
+                and "results", one dict per entry in recipients with its
+                "recipients", "status" ("sent" or "failed") and "error"
+        """
+        start = time.perf_counter()
+        results = [
+            {"recipients": self._addresses(data, to_field), "status": "failed", "error": None}
+            for data in recipients
+        ]
+        submitted = {}
+        with EmailQueue(
+            self.sender,
+            workers=self.connections,
+            maxsize=self.connections * 4,
+            retries=self.retries,
+            backoff=self.backoff,
+        ) as outbox, ThreadPoolExecutor(self.render_workers) as executor:
+            # Keep a bounded number of renders in flight, so that thousands of
+            # bodies are not held in memory while the connections catch up
+            pending = collections.deque()
+            for index, data in enumerate(recipients):
+                pending.append((index, executor.submit(self._render, data)))
+                if len(pending) < self.render_workers * 2:
+                    continue
+                self._submit(outbox, pending.popleft(), results, submitted, files)
+            while pending:
+                self._submit(outbox, pending.popleft(), results, submitted, files)
+            outbox.flush()
+
+            for message_id, index in submitted.items():
+                if message_id in outbox.failed:
+                    results[index]["error"] = str(outbox.failed[message_id])
+                else:
+                    results[index]["status"] = "sent"
+
+        seconds = time.perf_counter() - start
+        sent = sum(1 for result in results if result["status"] == "sent")
+        report = {
+            "sent": sent,
+            "failed": len(results) - sent,
+            "seconds": seconds,
+            "messages_per_second": sent / seconds if seconds else 0.0,
+            "results": results,
+        }
+        logging.info(
+            f"Mail merge sent {sent} of {len(results)} emails in {seconds:.1f} s "
+            f"({report['messages_per_second']:.1f} emails/s)"
+        )
+        return report
+
+    def _render(self, data: dict) -> tuple:
+        return self._subject.render(**data), self.templating.render(self._template, **data)
+
+    def _submit(self, outbox: EmailQueue, item: tuple, results: list, submitted: dict, files: list) -> None:
+        index, future = item
+        try:
+            subject, body = future.result()
+            message_id = outbox.submit(self.from_email, results[index]["recipients"], subject, body, files)
+        except Exception as e:
+            logging.error(f"Could not send email to {results[index]['recipients']}: {e}")
+            results[index]["error"] = str(e)
+            return
+        submitted[message_id] = index
+
+    @staticmethod
+    def _addresses(data: dict, to_field: str) -> list:
+        addresses = data.get(to_field, [])
+        return [addresses] if isinstance(addresses, str) else list(addresses)
@@ -1,10 +1,19 @@
 from pydantic import validate_call, EmailStr
+import base64
+import collections
+import functools
+import glob
+import json
 import logging
+import queue
+import re
 import smtplib
+import threading
+import time
+import uuid
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
 import os
 from pyprediktorutilities.shared import validate_file
 
@@ -14,19 +23,45 @@ logger.addHandler(logging.NullHandler())
 
 class SendEmail:
     """Helper function to send emails with attachments using SMTP
+
+    By default every email is sent over its own connection. Use the object as a
+    context manager (or call connect() and close()) to keep one authenticated
+    connection open for many emails. The connection is re-established
+    transparently if the server drops it.
+
+    Emails with attachments are streamed to the server: each attachment is read
+    and base64 encoded block by block while it is written to the socket, so
+    large files are never held in memory. An attachment sent more than once is
+    kept in encoded form from its second email on, up to attachment_cache_size
+    bytes in total, so an attachment sent to many recipients is not read and
+    encoded for every email.
     
     Args:
         server (str): SMTP server address
         port (int): SMTP server port
         username (str): SMTP server username
         password (str): SMTP server password
+        attachment_cache_size (int): The maximum number of bytes of encoded
+            attachments to keep. Defaults to 64 MB, 0 disables the cache
         
     Returns:
         Object: SendEmail object
+
+    Examples:
+        >>> with SendEmail(server, port, username, password) as email:
+        ...     email.send_email(sender, [recipient], "Subject 1", "Body 1")
+        ...     email.send_email(sender, [recipient], "Subject 2", "Body 2")
     """
     
     @validate_call
-    def __init__(self, server: str, port: int, username: str, password: str) -> object:
+    def __init__(
+        self,
+        server: str,
+        port: int,
+        username: str,
+        password: str,
+        attachment_cache_size: int = 2**26,
+    ) -> object:
         """Class initialiser
 
         Args:
@@ -34,6 +69,8 @@ class SendEmail:
             port (int): SMTP server port
             username (str): SMTP server username
             password (str): SMTP server password
+            attachment_cache_size (int): The maximum number of bytes of encoded
+                attachments to keep. Defaults to 64 MB
 
         Returns:
             object: SendEmail object
@@ -42,10 +79,36 @@ class SendEmail:
         self.smtp_server_port = port
         self.smtp_server_username = username
         self.smtp_server_password = password
+        self._attachments = _AttachmentCache(attachment_cache_size)
+        self._connection = None
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connect(self) -> None:
+        """Open a persistent, authenticated connection used by later emails until close()"""
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._open_connection()
+
+    def close(self) -> None:
+        """Close the persistent connection"""
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.quit()
+                except smtplib.SMTPException:
+                    self._connection.close()
+                self._connection = None
 
     @validate_call
     def send_email(self, from_email: EmailStr, recipients: list[EmailStr], subject: str, body: str, files: list = []):
-        """_summary_
+        """Send an email, over the persistent connection if there is one
 
         Args:
             from_email (email address): The sender email address
@@ -65,33 +128,453 @@ class SendEmail:
         msg["To"] = ', '.join(str(e) for e in recipients)
         msg.attach(MIMEText(body, "plain"))
 
+        placeholders = {}
         for file in files:
             validate_file(file)
-            
-            with open(file, "rb") as f:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(f.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    "Content-Disposition",
-                    f"attachment; filename={os.path.basename(file)}",
-                )
-                msg.attach(part)
 
+            # The generator writes the placeholder where the encoded file goes,
+            # _stream_message replaces it while sending
+            placeholder = f"attachment-{uuid.uuid4().hex}"
+            placeholders[placeholder] = file
+            part = MIMEBase("application", "octet-stream")
+            part.set_payload(placeholder)
+            part["Content-Transfer-Encoding"] = "base64"
+            part.add_header(
+                "Content-Disposition",
+                f"attachment; filename={os.path.basename(file)}",
+            )
+            msg.attach(part)
 
         text = msg.as_string()
+        if placeholders:
+            message = functools.partial(self._stream_message, text, placeholders)
+        else:
+            message = text
         reciplist = [str(e) for e in recipients]
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_server_port) as server:
-                server.starttls()
-                server.login(self.smtp_server_username, self.smtp_server_password)
-                server.sendmail(str(from_email), reciplist, text)
-                logging.info(f"Email sent to {reciplist} with subject {subject} and {len(files)} attachments")
+            self._deliver(str(from_email), reciplist, message)
+            logging.info(f"Email sent to {reciplist} with subject {subject} and {len(files)} attachments")
         except smtplib.SMTPException as e:
             logging.error(f"Error: unable to send email to {reciplist} with subject {subject} and {len(files)} attachments")
             logging.error(e)
             raise e
 
+    @validate_call
+    def send_bulk(self, messages: list[dict], rate: float = None) -> list:
+        """Send many emails over one persistent connection. A connection is opened
+        for the duration of the call if there is none already. A message that
+        fails does not stop the others.
+
+        Args:
+            messages (list[dict]): The emails to send, each a dict with the
+                arguments of send_email (from_email, recipients, subject, body
+                and optionally files)
+            rate (float, optional): The maximum number of emails sent per second.
+                Defaults to None (no limit)
+
+        Returns:
+            list: For each message, None if it was sent or the exception raised
+        """
+        results = []
+        persistent = self._connection is not None
+        interval = 1 / rate if rate else 0
+        next_send = time.monotonic()
+        try:
+            if not persistent:
+                self.connect()
+            for message in messages:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send, time.monotonic()) + interval
+                try:
+                    self.send_email(**message)
+                    results.append(None)
+                except Exception as e:
+                    results.append(e)
+        finally:
+            if not persistent:
+                self.close()
+        sent = results.count(None)
+        logging.info(f"Bulk send finished, {sent} of {len(messages)} emails sent")
+        return results
+
+    def _open_connection(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.smtp_server, self.smtp_server_port)
+        try:
+            server.starttls()
+            server.login(self.smtp_server_username, self.smtp_server_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _stream_message(self, text: str, placeholders: dict):
+        """Yield the message as CRLF terminated, dot-stuffed bytes, with each
+        placeholder replaced by the base64 encoded attachment"""
+        pattern = "(" + "|".join(placeholders) + ")"
+        for i, segment in enumerate(re.split(pattern, text)):
+            if i % 2:
+                yield from self._attachments.encoded(placeholders[segment])
+            elif segment:
+                yield smtplib.quotedata(segment).encode("ascii")
+
+    def _deliver(self, from_email: str, reciplist: list[str], message) -> None:
+        """Send the message over the persistent connection, reconnecting once if
+        the server has dropped it, or over a connection of its own. A streamed
+        message is passed as a function returning the stream, so that it can be
+        started again after a reconnect"""
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    _transmit(self._connection, from_email, reciplist, message)
+                except smtplib.SMTPServerDisconnected:
+                    logging.warning(f"Connection to {self.smtp_server} was dropped, reconnecting")
+                    self._connection = self._open_connection()
+                    _transmit(self._connection, from_email, reciplist, message)
+                return
+
+        with self._open_connection() as server:
+            _transmit(server, from_email, reciplist, message)
+
+
+def _transmit(server: smtplib.SMTP, from_email: str, reciplist: list[str], message) -> dict:
+    """Send a message given as a string with sendmail, or given as a function
+    returning a stream of ready-to-send bytes through the same SMTP exchange
+    sendmail uses, writing each block to the socket as it is produced"""
+    if not callable(message):
+        return server.sendmail(from_email, reciplist, message)
+
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_email)
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_email)
+    refused = {}
+    for recipient in reciplist:
+        code, resp = server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, resp)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(reciplist):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, resp = server.docmd("data")
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    try:
+        ends_with_newline = True
+        for block in message():
+            if block:
+                server.send(block)
+                ends_with_newline = block.endswith(b"\r\n")
+        server.send(b".\r\n" if ends_with_newline else b"\r\n.\r\n")
+    except BaseException:
+        # The server is still in the middle of DATA and would take the next
+        # command as part of this message, so the connection is given up. A
+        # persistent connection is re-established by the next email
+        server.close()
+        raise
+    code, resp = server.getreply()
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+class _AttachmentCache:
+    """Base64 encodes attachments for sending, block by block. A file is kept
+    in encoded form from the second time it is sent, so files sent once are
+    never held in memory, up to max_bytes in total for the most recently used
+    files. An entry is keyed on the path, size and modification time, so a
+    changed file is encoded again"""
+
+    # 57 bytes encode to one 76 character line
+    BLOCK_SIZE = 57 * 1024
+    # The number of files sent once that are remembered
+    MAX_SEEN = 1024
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._seen = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def encoded(self, file: str):
+        """Yield the file as base64 lines ending in CRLF"""
+        stat = os.stat(file)
+        key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+        if 4 * ((stat.st_size + 2) // 3) * 78 // 76 > self.max_bytes:
+            yield from self._encode(file)
+            return
+
+        with self._lock:
+            blocks = self._entries.get(key)
+            if blocks is not None:
+                self._entries.move_to_end(key)
+            reused = self._seen.pop(key, None) is not None
+            if blocks is None and not reused:
+                self._seen[key] = True
+                if len(self._seen) > self.MAX_SEEN:
+                    self._seen.popitem(last=False)
+        if blocks is not None:
+            yield from blocks
+            return
+        if not reused:
+            yield from self._encode(file)
+            return
+
+        # Collect the blocks of a reused file while they are sent
+        blocks = []
+        for block in self._encode(file):
+            blocks.append(block)
+            yield block
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = blocks
+                self._size += sum(len(block) for block in blocks)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= sum(len(block) for block in evicted)
+
+    def _encode(self, file: str):
+        with open(file, "rb") as f:
+            while block := f.read(self.BLOCK_SIZE):
+                yield base64.encodebytes(block).replace(b"\n", b"\r\n")
+
+class EmailQueue:
+    """Send emails in the background so the caller does not wait for the SMTP
+    exchange. Messages go into a bounded queue that a pool of worker threads
+    drains, each worker over its own persistent connection. Transient failures
+    (dropped connections, 4xx replies, network errors) are retried with
+    exponential backoff, permanent ones are recorded in failed.
+
+    With a spool directory every message is written to disk before it is
+    queued and removed once it has been handled, so messages that were queued
+    when the process died are sent when the next EmailQueue starts on the same
+    directory.
+
+    Args:
+        sender (SendEmail): Provides the SMTP server and credentials
+        workers (int): The number of worker threads and connections. Defaults to 2
+        maxsize (int): The maximum number of queued messages, submit blocks when
+            the queue is full. Defaults to 100
+        retries (int): The number of retries of a transient failure. Defaults to 3
+        backoff (float): Seconds before the first retry, doubled for every
+            following retry. Defaults to 1
+        spool_directory (str, optional): Folder to spool queued messages to
+
+    Attributes:
+        sent (int): The number of messages sent
+        failed (dict): The ids of messages that could not be sent, mapped to the
+            last exception
+
+    Examples:
+        >>> with EmailQueue(SendEmail(server, port, username, password), workers=4) as outbox:
+        ...     outbox.submit(sender, [recipient], subject, body)
+    """
+
+    @validate_call(config=dict(arbitrary_types_allowed=True))
+    def __init__(
+        self,
+        sender: SendEmail,
+        workers: int = 2,
+        maxsize: int = 100,
+        retries: int = 3,
+        backoff: float = 1.0,
+        spool_directory: str = None,
+    ) -> None:
+        self.sender = sender
+        self.retries = retries
+        self.backoff = backoff
+        self.spool_directory = spool_directory
+        self.sent = 0
+        self.failed = {}
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"EmailQueue-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        if spool_directory is not None:
+            os.makedirs(spool_directory, exist_ok=True)
+            self._recover()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    @validate_call
+    def submit(
+        self,
+        from_email: EmailStr,
+        recipients: list[EmailStr],
+        subject: str,
+        body: str,
+        files: list = [],
+        timeout: float = None,
+    ) -> str:
+        """Queue an email. The arguments are validated straight away, the email
+        is sent by one of the workers
+
+        Args:
+            from_email (email address): The sender email address
+            recipients (list of email addresses): list of one or more recipient email addresses
+            subject (str): The email subject
+            body (str): The email body
+            files (list, optional): A list of paths to files to include. Defaults to [].
+            timeout (float, optional): Seconds to wait for room in a full queue.
+                Defaults to None (wait as long as it takes)
+
+        Raises:
+            ValueError: If there are no recipients
+            FileNotFoundError: If an attachment does not exist
+            queue.Full: If the queue is still full after timeout seconds
+
+        Returns:
+            str: The id of the queued message
+        """
+        if len(recipients) == 0:
+            logging.error("No recipients specified")
+            raise ValueError("No recipients specified")
+        for file in files:
+            validate_file(file)
+
+        message = {
+            "from_email": str(from_email),
+            "recipients": [str(e) for e in recipients],
+            "subject": subject,
+            "body": body,
+            "files": list(files),
+        }
+        message_id = f"{time.time_ns()}-{uuid.uuid4().hex}"
+        if self.spool_directory is not None:
+            self._spool(message_id, message)
+        try:
+            self._queue.put((message_id, message), timeout=timeout)
+        except queue.Full:
+            self._unspool(message_id)
+            raise
+        return message_id
+
+    def flush(self) -> None:
+        """Wait until every queued message has been sent or has failed"""
+        self._queue.join()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers and close their connections
+
+        Args:
+            wait (bool): Send the queued messages first. Without it, messages
+                still queued are left in the spool directory, if there is one.
+                Defaults to True
+        """
+        if wait:
+            self.flush()
+        else:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                except queue.Empty:
+                    break
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self) -> None:
+        sender = SendEmail(
+            self.sender.smtp_server,
+            self.sender.smtp_server_port,
+            self.sender.smtp_server_username,
+            self.sender.smtp_server_password,
+        )
+        sender._attachments = self.sender._attachments
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        return
+                    self._send(sender, *item)
+                finally:
+                    self._queue.task_done()
+        finally:
+            sender.close()
+
+    def _send(self, sender: SendEmail, message_id: str, message: dict) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                sender.connect()
+                sender.send_email(**message)
+            except Exception as e:
+                if attempt < self.retries and self._is_transient(e):
+                    delay = self.backoff * 2**attempt
+                    logging.warning(f"Sending {message_id} failed ({e}), retrying in {delay} s")
+                    sender.close()
+                    time.sleep(delay)
+                    continue
+                logging.error(f"Giving up on {message_id} to {message['recipients']}: {e}")
+                with self._lock:
+                    self.failed[message_id] = e
+            else:
+                with self._lock:
+                    self.sent += 1
+            self._unspool(message_id)
+            return
+
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500 or isinstance(error, smtplib.SMTPConnectError)
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, (smtplib.SMTPException, FileNotFoundError)):
+            return False
+        return isinstance(error, OSError)
+
+    def _spool(self, message_id: str, message: dict) -> None:
+        path = os.path.join(self.spool_directory, f"{message_id}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(message, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _unspool(self, message_id: str) -> None:
+        if self.spool_directory is not None:
+            try:
+                os.remove(os.path.join(self.spool_directory, f"{message_id}.json"))
+            except FileNotFoundError:
+                pass
+
+    def _recover(self) -> None:
+        """Queue the messages left in the spool directory by an earlier run"""
+        for path in sorted(glob.glob(os.path.join(self.spool_directory, "*.json"))):
+            message_id = os.path.basename(path)[: -len(".json")]
+            try:
+                with open(path, "r") as f:
+                    message = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not read spooled message {path}: {e}")
+                continue
+            logging.info(f"Recovered spooled message {message_id}")
+            self._queue.put((message_id, message))
+
 
 if __name__ == "__main__":
     pass
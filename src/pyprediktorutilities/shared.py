@@ -1,9 +1,24 @@
 import requests
 from pydantic import AnyUrl, validate_call
-from typing import Literal
+from typing import Literal, Iterable, Iterator, Any, Union
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from threading import Event, Lock, Thread
+import hashlib
+import json
 import logging
+import os
+import queue
+import time
+import zlib
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
@@ -22,15 +37,447 @@ def validate_file(file: str):
         raise FileNotFoundError(errormsg)
 
 
-@validate_call
+def _compressor(encoding: str):
+    """Returns a streaming compressor for the content encoding"""
+    if encoding == "gzip":
+        return zlib.compressobj(wbits=31)
+    try:
+        import zstandard
+    except ImportError:
+        errormsg = "zstd compression requires the zstandard package (pip install zstandard)"
+        logging.error(errormsg)
+        raise ImportError(errormsg)
+    return zstandard.ZstdCompressor().compressobj()
+
+
+def _compress_chunks(chunks: Iterable[Union[str, bytes]], compressor) -> Iterator[bytes]:
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _compress_body(data: Union[str, bytes, Iterable[bytes]], encoding: str) -> Union[bytes, Iterator[bytes]]:
+    """Compress a request body. Strings and bytes are compressed in one go, other
+    iterables are compressed chunk by chunk as requests streams them"""
+    compressor = _compressor(encoding)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if isinstance(data, bytes):
+        return compressor.compress(data) + compressor.flush()
+    return _compress_chunks(data, compressor)
+
+
+def _send_request(
+    rest_url: AnyUrl,
+    method: str,
+    endpoint: str,
+    data: Union[str, bytes, Iterable[bytes]] = None,
+    params: dict = None,
+    headers: dict = None,
+    extended_timeout: bool = False,
+    stream: bool = False,
+    compress: str = None,
+) -> requests.Response:
+    """Perform the HTTP request and return the raw response after checking the status.
+    Unless the headers say otherwise, requests asks for compressed responses in
+    every encoding the installed urllib3 can decode (gzip and deflate, plus br
+    and zstd with the compression extra)"""
+    request_timeout = (3, 300 if extended_timeout else 27)
+    combined_url = f"{rest_url}{endpoint}"
+    headers = dict(headers or {})
+    if compress is not None and data is not None:
+        data = _compress_body(data, compress)
+        headers["Content-Encoding"] = compress
+    if method == "GET":
+        result = requests.get(
+            combined_url, timeout=request_timeout, params=params, headers=headers, stream=stream
+        )
+
+    if method == "POST":
+        result = requests.post(
+            combined_url, data=data, headers=headers, timeout=request_timeout, params=params, stream=stream
+        )
+
+    result.raise_for_status()
+    return result
+
+
+def _decode_json(content: bytes, encoding: str = None) -> Any:
+    """Decode a JSON response body in the charset the response declared. UTF-8
+    bodies, and bodies without a charset, are passed to _loads as bytes, others
+    are decoded to text first, as Response.json() does"""
+    if encoding is None or encoding.lower() in ("utf-8", "utf8"):
+        return _loads(content)
+    try:
+        text = str(content, encoding, errors="replace")
+    except LookupError:
+        text = str(content, "utf-8", errors="replace")
+    return _loads(text)
+
+
+def _loads(content: Union[str, bytes]) -> Any:
+    """Decode a JSON document, using orjson when it is installed. Invalid JSON
+    raises requests.exceptions.JSONDecodeError, as Response.json() does"""
+    try:
+        if orjson is not None:
+            return orjson.loads(content)
+        return json.loads(content)
+    except json.JSONDecodeError as e:
+        raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos) from e
+
+
+def _request_key(method: str, url: str, params: dict = None, headers: dict = None) -> str:
+    """Returns a hex digest identifying a request by method, URL, params and headers"""
+    parts = [
+        method,
+        url,
+        sorted((str(k), str(v)) for k, v in (params or {}).items()),
+        sorted((str(k).lower(), str(v)) for k, v in (headers or {}).items()),
+    ]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class ResponseCache:
+    """An opt-in HTTP cache for GET requests made through request_from_api.
+    Entries are kept in an in-memory LRU and optionally persisted to a folder
+    on disk, so they survive process restarts. Cache-Control is honoured
+    (no-store, no-cache and max-age, falling back to Expires), and stale entries
+    are revalidated with If-None-Match/If-Modified-Since.
+
+    Args:
+        max_entries (int): The maximum number of responses kept in memory
+        directory (str): Optional folder for the on-disk store
+        default_ttl (float): Seconds a response is considered fresh when the
+            server does not say otherwise. Defaults to 0 (always revalidate)
+        vary_headers (tuple): Request headers that are part of the cache key
+
+    Attributes:
+        hits (int): Requests answered from the cache without contacting the server
+        misses (int): Requests that required a full response from the server
+        revalidations (int): Stale entries confirmed unchanged by a 304 response
+    """
+
+    @validate_call
+    def __init__(
+        self,
+        max_entries: int = 256,
+        directory: str = None,
+        default_ttl: float = 0,
+        vary_headers: tuple[str, ...] = ("Accept", "Accept-Language", "Authorization"),
+    ) -> None:
+        self.max_entries = max_entries
+        self.directory = directory
+        self.default_ttl = default_ttl
+        self.vary_headers = tuple(h.lower() for h in vary_headers)
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def stats(self) -> dict:
+        """Returns the hit, miss and revalidation counters"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+        }
+
+    def key(self, method: str, url: str, params: dict = None, headers: dict = None) -> str:
+        """Returns the cache key for a request
+
+        Args:
+            method (str): The HTTP method
+            url (str): The full URL
+            params (dict): The query parameters
+            headers (dict): The request headers, only vary_headers are used
+
+        Returns:
+            str: A hex digest identifying the request
+        """
+        relevant = {k: v for k, v in (headers or {}).items() if k.lower() in self.vary_headers}
+        return _request_key(method, url, params, relevant)
+
+    def get(self, key: str) -> dict:
+        """Returns the cached entry for the key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._read_from_disk(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def store(self, key: str, response: requests.Response) -> None:
+        """Store a response, unless the server asked us not to or it can never be reused"""
+        directives = self._cache_control(response.headers)
+        if "no-store" in directives:
+            return
+        entry = {
+            "content": response.content,
+            "encoding": response.encoding,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        self._set_expiry(entry, response.headers)
+        if entry["expires"] <= time.time() and not (entry["etag"] or entry["last_modified"]):
+            return
+        self._remember(key, entry)
+        self._write_to_disk(key, entry)
+
+    def refresh(self, key: str, entry: dict, response: requests.Response) -> None:
+        """Update the lifetime of an entry after a successful revalidation"""
+        self._set_expiry(entry, response.headers)
+        self._remember(key, entry)
+        self._write_to_disk(key, entry)
+
+    def clear(self) -> None:
+        """Remove all entries from memory and disk and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.revalidations = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith((".json", ".body")):
+                    os.remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        """Returns True if the entry can be used without revalidation"""
+        return entry["expires"] > time.time()
+
+    @staticmethod
+    def _cache_control(headers) -> dict:
+        directives = {}
+        for directive in headers.get("Cache-Control", "").split(","):
+            name, _, value = directive.strip().partition("=")
+            if name:
+                directives[name.lower()] = value.strip('"')
+        return directives
+
+    def _set_expiry(self, entry: dict, headers) -> None:
+        directives = self._cache_control(headers)
+        now = time.time()
+        if "no-cache" in directives:
+            entry["expires"] = now
+        elif "max-age" in directives:
+            try:
+                entry["expires"] = now + int(directives["max-age"])
+            except ValueError:
+                entry["expires"] = now
+        elif headers.get("Expires"):
+            try:
+                entry["expires"] = parsedate_to_datetime(headers["Expires"]).timestamp()
+            except (TypeError, ValueError):
+                entry["expires"] = now
+        else:
+            entry["expires"] = now + self.default_ttl
+
+    def _record(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _remember(self, key: str, entry: dict) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read_from_disk(self, key: str) -> dict:
+        if self.directory is None:
+            return None
+        base = os.path.join(self.directory, key)
+        try:
+            with open(f"{base}.json", "r") as f:
+                entry = json.load(f)
+            with open(f"{base}.body", "rb") as f:
+                entry["content"] = f.read()
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def _write_to_disk(self, key: str, entry: dict) -> None:
+        if self.directory is None:
+            return
+        base = os.path.join(self.directory, key)
+        metadata = {k: v for k, v in entry.items() if k != "content"}
+        try:
+            with open(f"{base}.body.tmp", "wb") as f:
+                f.write(entry["content"])
+            os.replace(f"{base}.body.tmp", f"{base}.body")
+            with open(f"{base}.json.tmp", "w") as f:
+                json.dump(metadata, f)
+            os.replace(f"{base}.json.tmp", f"{base}.json")
+        except OSError as e:
+            logging.warning(f"Could not write cache entry to {self.directory}: {e}")
+
+
+class _Flight:
+    """A single in-flight call that concurrent callers can wait for"""
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """Single-flight deduplication of identical concurrent GET requests made
+    through request_from_api. While a request is in flight, identical requests
+    from other threads wait for it and share its response instead of sending
+    their own.
+
+    With a stale_while_revalidate window, a completed response is also served
+    to identical requests for that many seconds afterwards, while a single
+    background request refreshes it.
+
+    Args:
+        stale_while_revalidate (float): Seconds a completed response may be
+            served while it is refreshed in the background. Defaults to 0 (off)
+
+    Attributes:
+        coalesced (int): Requests that shared another request's response
+        stale (int): Requests answered with a response inside the stale window
+    """
+
+    @validate_call
+    def __init__(self, stale_while_revalidate: float = 0) -> None:
+        self.stale_while_revalidate = stale_while_revalidate
+        self.coalesced = 0
+        self.stale = 0
+        self._flights = {}
+        self._completed = {}
+        self._lock = Lock()
+
+    def do(self, key: str, fn) -> Any:
+        """Call fn, unless an identical call identified by key is already in
+        flight, in which case wait for it and return its result
+
+        Args:
+            key (str): Identifies identical calls
+            fn (callable): The call to perform
+
+        Raises:
+            Exception: Whatever the shared call raised
+
+        Returns:
+            Any: The result of the shared call
+        """
+        with self._lock:
+            completed = self._completed.get(key)
+            if completed is not None:
+                finished, result = completed
+                if time.monotonic() - finished <= self.stale_while_revalidate:
+                    self.stale += 1
+                    if key not in self._flights:
+                        flight = self._flights[key] = _Flight()
+                        Thread(target=self._run, args=(key, fn, flight), daemon=True).start()
+                    return result
+                del self._completed[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            self._run(key, fn, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _run(self, key: str, fn, flight: _Flight) -> None:
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            logging.error(f"Shared request failed: {e}")
+        except BaseException:
+            # The leader re-raises e.g. KeyboardInterrupt, the waiting callers
+            # get an error instead of blocking forever
+            flight.error = RuntimeError("Shared request was interrupted")
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and self.stale_while_revalidate > 0:
+                    self._complete(key, flight.result)
+            flight.done.set()
+
+    def _complete(self, key: str, result: Any) -> None:
+        """Remember a result for the stale window and forget the results that
+        have expired. Results are kept in completion order, so the expired ones
+        are at the front"""
+        now = time.monotonic()
+        self._completed.pop(key, None)
+        self._completed[key] = (now, result)
+        while True:
+            oldest = next(iter(self._completed))
+            if now - self._completed[oldest][0] <= self.stale_while_revalidate:
+                return
+            del self._completed[oldest]
+
+
+def _cached_get(
+    cache: ResponseCache,
+    rest_url: AnyUrl,
+    endpoint: str,
+    params: dict = None,
+    headers: dict = None,
+    extended_timeout: bool = False,
+) -> tuple:
+    """Perform a GET request through the cache and return the response body and
+    its encoding"""
+    key = cache.key("GET", f"{rest_url}{endpoint}", params, headers)
+    entry = cache.get(key)
+    if entry is not None and cache.is_fresh(entry):
+        cache._record("hits")
+        return entry["content"], entry.get("encoding")
+
+    request_headers = dict(headers or {})
+    if entry is not None:
+        if entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+
+    result = _send_request(rest_url, "GET", endpoint, None, params, request_headers, extended_timeout)
+    if entry is not None and result.status_code == 304:
+        cache._record("revalidations")
+        cache.refresh(key, entry, result)
+        return entry["content"], entry.get("encoding")
+
+    cache._record("misses")
+    cache.store(key, result)
+    return result.content, result.encoding
+
+
+@validate_call(config=dict(arbitrary_types_allowed=True))
 def request_from_api(
     rest_url: AnyUrl,
     method: Literal["GET", "POST"],
     endpoint: str,
-    data: str = None,
+    data: Union[str, bytes, Iterable[bytes]] = None,
     params: dict = None,
     headers: dict = None,
     extended_timeout: bool = False,
+    cache: ResponseCache = None,
+    coalescer: RequestCoalescer = None,
+    compress: Literal["gzip", "zstd"] = None,
 ) -> str:
     """Function to perform request against a REST API
 
@@ -38,20 +485,263 @@ def request_from_api(
         rest_url (str): The URL with trailing shash
         method (str): "GET" or "POST"
         endpoint (str): The last part of the url (without the leading slash)
-        data (str): defaults to None but can contain the data to send to the endpoint
+        data (str | bytes | iterable of bytes): defaults to None but can contain the data
+            to send to the endpoint. Iterables are streamed with chunked encoding
         headers (str): default to None but can contain the headers og the request
+        cache (ResponseCache): defaults to None but can contain a cache to use for GET requests
+        coalescer (RequestCoalescer): defaults to None but can contain a coalescer
+            sharing identical concurrent GET requests
+        compress (str): "gzip" or "zstd" to compress the data sent. Defaults to None
     Returns:
         JSON: The result if successfull
     """
-    request_timeout = (3, 300 if extended_timeout else 27)
-    combined_url = f"{rest_url}{endpoint}"
-    if method == "GET":
-        result = requests.get(combined_url, timeout=request_timeout, params=params, headers=headers)
+    if method == "GET" and (cache is not None or coalescer is not None):
 
-    if method == "POST":
-        result = requests.post(
-            combined_url, data=data, headers=headers, timeout=request_timeout, params=params
+        def fetch() -> tuple:
+            if cache is not None:
+                return _cached_get(cache, rest_url, endpoint, params, headers, extended_timeout)
+            result = _send_request(rest_url, method, endpoint, None, params, headers, extended_timeout)
+            return result.content, result.encoding
+
+        if coalescer is None:
+            return _decode_json(*fetch())
+        key = _request_key(method, f"{rest_url}{endpoint}", params, headers)
+        return _decode_json(*coalescer.do(key, fetch))
+
+    result = _send_request(
+        rest_url, method, endpoint, data, params, headers, extended_timeout, compress=compress
+    )
+    return _decode_json(result.content, result.encoding)
+
+
+@validate_call
+def stream_from_api(
+    rest_url: AnyUrl,
+    method: Literal["GET", "POST"],
+    endpoint: str,
+    data: Union[str, bytes, Iterable[bytes]] = None,
+    params: dict = None,
+    headers: dict = None,
+    extended_timeout: bool = False,
+    prefix: str = "item",
+    chunk_size: int = 65536,
+    compress: Literal["gzip", "zstd"] = None,
+) -> Iterator[Any]:
+    """Perform a request against a REST API and iterate over the elements of the
+    JSON response as they arrive, instead of decoding the whole body at once.
+    Peak memory scales with a single element rather than the full payload.
+    Requires the optional ijson package.
+
+    Args:
+        rest_url (str): The URL with trailing shash
+        method (str): "GET" or "POST"
+        endpoint (str): The last part of the url (without the leading slash)
+        data (str | bytes | iterable of bytes): defaults to None but can contain the data
+            to send to the endpoint. Iterables are streamed with chunked encoding
+        params (dict): defaults to None but can contain the query parameters
+        headers (dict): default to None but can contain the headers of the request
+        extended_timeout (bool): Use a longer read timeout
+        prefix (str): The ijson prefix of the elements to yield. Defaults to "item",
+            i.e. each element of a top level array. Use e.g. "Values.item" for an
+            array inside a top level object
+        chunk_size (int): The number of bytes to read from the socket at a time
+        compress (str): "gzip" or "zstd" to compress the data sent. Defaults to None
+
+    Raises:
+        ImportError: If ijson is not installed
+
+    Yields:
+        JSON: One decoded element at a time
+    """
+    try:
+        import ijson
+    except ImportError:
+        errormsg = "Streaming requires the ijson package (pip install ijson)"
+        logging.error(errormsg)
+        raise ImportError(errormsg)
+
+    result = _send_request(
+        rest_url, method, endpoint, data, params, headers, extended_timeout, stream=True, compress=compress
+    )
+    with result:
+        items = ijson.sendable_list()
+        coro = ijson.items_coro(items, prefix, use_float=True)
+        for chunk in result.iter_content(chunk_size=chunk_size):
+            coro.send(chunk)
+            yield from items
+            del items[:]
+        coro.close()
+        yield from items
+
+
+def _page_length(page: Any, items_field: str = None) -> int:
+    """Returns the number of items in a decoded page"""
+    if items_field is not None:
+        page = page.get(items_field) or []
+    elif not isinstance(page, list):
+        errormsg = f"Offset pages must be arrays unless items_field is set, got {type(page).__name__}"
+        logging.error(errormsg)
+        raise TypeError(errormsg)
+    return len(page)
+
+
+def _prefetch(pages: Iterator[Any], size: int) -> Iterator[Any]:
+    """Consume an iterator in a background thread, keeping at most size items
+    buffered ahead of the caller"""
+    if size < 1:
+        yield from pages
+        return
+
+    buffer = queue.Queue(maxsize=size)
+    stop = Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put((page, None)):
+                    return
+        except Exception as e:
+            put((done, e))
+        else:
+            put((done, None))
+
+    Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            page, error = buffer.get()
+            if page is done:
+                if error is not None:
+                    raise error
+                return
+            yield page
+    finally:
+        stop.set()
+
+
+@validate_call
+def paginate_from_api(
+    rest_url: AnyUrl,
+    method: Literal["GET", "POST"],
+    endpoint: str,
+    data: str = None,
+    params: dict = None,
+    headers: dict = None,
+    extended_timeout: bool = False,
+    pagination: Literal["offset", "token", "link"] = "offset",
+    page_size: int = 100,
+    limit_param: str = "limit",
+    offset_param: str = "offset",
+    token_param: str = "continuationToken",
+    token_field: str = "continuationToken",
+    items_field: str = None,
+    prefetch: int = 2,
+) -> Iterator[Any]:
+    """Iterate over the pages of a paged REST endpoint. The next pages are fetched
+    in the background while the caller processes the current one, with at most
+    `prefetch` pages buffered ahead.
+
+    Supported schemes:
+        offset: Pages are requested with `limit_param` and `offset_param` in the
+            query. Iteration stops at the first page with fewer than `page_size`
+            items. Up to `prefetch` pages are fetched concurrently
+        token: The continuation token is read from `token_field` of each page and
+            sent as `token_param` in the next request. Iteration stops when the
+            token is missing
+        link: The next page is the "next" relation of the Link response header
+
+    Args:
+        rest_url (str): The URL with trailing shash
+        method (str): "GET" or "POST"
+        endpoint (str): The last part of the url (without the leading slash)
+        data (str): defaults to None but can contain the data to send to the endpoint
+        params (dict): defaults to None but can contain the query parameters
+        headers (dict): default to None but can contain the headers of the request
+        extended_timeout (bool): Use a longer read timeout
+        pagination (str): "offset", "token" or "link"
+        page_size (int): The number of items per page for offset pagination
+        limit_param (str): The query parameter holding the page size
+        offset_param (str): The query parameter holding the offset
+        token_param (str): The query parameter holding the continuation token
+        token_field (str): The field of the page holding the continuation token
+        items_field (str): The field of the page holding the items, if the page
+            is an object rather than an array. Used for offset pagination
+        prefetch (int): The number of pages to fetch ahead. 0 disables prefetching
+
+    Raises:
+        ValueError: If prefetch is negative
+        TypeError: If an offset page is not an array and items_field is not set
+
+    Yields:
+        JSON: One decoded page at a time
+    """
+    if prefetch < 0:
+        errormsg = "prefetch must be 0 or more"
+        logging.error(errormsg)
+        raise ValueError(errormsg)
+    params = dict(params or {})
+
+    def fetch(url, endpoint, params):
+        result = _send_request(url, method, endpoint, data, params, headers, extended_timeout)
+        return result, _decode_json(result.content, result.encoding)
+
+    if pagination == "offset":
+        yield from _paginate_by_offset(
+            fetch, rest_url, endpoint, params, page_size, limit_param, offset_param, items_field, prefetch
         )
+        return
 
-    result.raise_for_status()
-    return result.json()
+    def pages():
+        url, path, query = rest_url, endpoint, params
+        while True:
+            result, page = fetch(url, path, query)
+            yield page
+            if pagination == "token":
+                token = page.get(token_field) if isinstance(page, dict) else None
+                if not token:
+                    return
+                query = {**params, token_param: token}
+            else:
+                next_url = result.links.get("next", {}).get("url")
+                if not next_url:
+                    return
+                url, path, query = next_url, "", None
+
+    yield from _prefetch(pages(), prefetch)
+
+
+def _paginate_by_offset(
+    fetch, rest_url, endpoint, params, page_size, limit_param, offset_param, items_field, prefetch
+) -> Iterator[Any]:
+    """Fetch offset/limit pages through a sliding window of concurrent requests"""
+    executor = ThreadPoolExecutor(max_workers=prefetch + 1)
+    futures = deque()
+    next_offset = 0
+
+    def submit():
+        nonlocal next_offset
+        query = {**params, limit_param: page_size, offset_param: next_offset}
+        futures.append(executor.submit(fetch, rest_url, endpoint, query))
+        next_offset += page_size
+
+    try:
+        for _ in range(prefetch + 1):
+            submit()
+        while True:
+            _, page = futures.popleft().result()
+            last = _page_length(page, items_field) < page_size
+            yield page
+            if last:
+                return
+            submit()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
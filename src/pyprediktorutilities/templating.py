@@ -1,7 +1,32 @@
-from jinja2 import Environment, FileSystemLoader, select_autoescape, StrictUndefined
-from pyprediktorutilities.shared import validate_folder, validate_file
+from jinja2 import (
+    __version__ as jinja2_version,
+    BytecodeCache,
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    ModuleLoader,
+    select_autoescape,
+    StrictUndefined,
+    Template,
+    TemplateNotFound,
+    nodes,
+)
+from jinja2.ext import Extension
+from pyprediktorutilities.shared import validate_folder
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from typing import Callable, Union
+import gzip
+import inspect
+import io
+import json
 import logging
 import os
+import threading
+import time
+import zipfile
+import zlib
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -11,8 +36,50 @@ class Templating:
     """Simple wrapper around a templating engine, allowing for easy rendering of templates
     such as XMLs and HTMLs. Build on top of Jinja2
     
+    Compiling a template is often more expensive than rendering it. Pass a
+    bytecode_cache to keep the compiled templates between processes, either as
+    a folder to store them in or as any Jinja2 BytecodeCache (for example a
+    MemcachedBytecodeCache shared by several hosts). A cached template is only
+    used while the checksum of its source matches, so edited templates are
+    compiled again. Call precompile() to fill the cache ahead of time.
+
+    By default every render checks whether the template file has changed. In
+    production mode templates are loaded once and kept, so that repeated
+    renders do not touch the file system at all. Call invalidate() to pick up
+    changed templates.
+
+    To start without parsing any templates, compile them ahead of time with
+    compile_templates() and pass the result as precompiled. Templates missing
+    from it are loaded from the folder as usual.
+
+    Parts of a template that render the same for many documents can be wrapped
+    in {% cache key %}...{% endcache %}. The part is rendered once per key and
+    template and reused, up to fragment_cache_size parts; fragment_cache_stats
+    tells how well that works.
+
+    To find out where render time goes, pass profile=True, or a function that
+    is called with every record. The compile time of each template and the
+    time, output size and time per {% block %} of each render are recorded,
+    and summarised by profile_summary() and profile_report().
+
+    With enable_async, templates can call async functions, which are awaited
+    while rendering, and render_async() and render_stream_async() render
+    without blocking the event loop.
+
     Args:
         path (str): The path to the folder containing the templates
+        bytecode_cache (str | jinja2.BytecodeCache, optional): A folder or cache
+            for compiled templates. Defaults to None (no cache)
+        production (bool): Keep loaded templates without checking for changes.
+            Defaults to False
+        enable_async (bool): Render with asyncio. Defaults to False
+        precompiled (str, optional): A zip file or folder written by
+            compile_templates(). Defaults to None
+        fragment_cache_size (int): The number of {% cache %} parts to keep.
+            Defaults to 1024
+        profile (bool | Callable[[dict], None]): Record compile and render
+            times, passing every record to the function if one is given.
+            Defaults to False
     
     Attributes:
         path (str): The path to the folder containing the templates
@@ -32,19 +99,47 @@ class Templating:
         >>> templating.render_to_file(template, 'output.html', title='Home')
     """
     
-    def __init__(self, path: str) -> object:
+    def __init__(
+        self,
+        path: str,
+        bytecode_cache: Union[str, BytecodeCache] = None,
+        production: bool = False,
+        enable_async: bool = False,
+        precompiled: str = None,
+        fragment_cache_size: int = 1024,
+        profile: Union[bool, Callable[[dict], None]] = False,
+    ) -> object:
         """Class initialization
 
         Args:
             path (str): The path to the folder containing the templates
+            bytecode_cache (str | jinja2.BytecodeCache, optional): A folder or
+                cache for compiled templates. Defaults to None (no cache)
+            production (bool): Keep loaded templates without checking for
+                changes. Defaults to False
+            enable_async (bool): Render with asyncio. Defaults to False
+            precompiled (str, optional): A zip file or folder written by
+                compile_templates(). Defaults to None
+            fragment_cache_size (int): The number of {% cache %} parts to keep.
+                Defaults to 1024
+            profile (bool | Callable[[dict], None]): Record compile and render
+                times, passing every record to the function if one is given.
+                Defaults to False
 
         Raises:
-            FileNotFoundError: If the folder does not exist
+            FileNotFoundError: If the folder or the precompiled templates do not exist
+            ValueError: If the precompiled templates were built with another
+                Jinja2 version or enable_async
 
         Returns:
             object: Templating object
         """
         self.path = path
+        self.production = production
+        self._bytecode_cache = bytecode_cache
+        self._precompiled = precompiled
+        self._profile = profile
+        self._templates = {}
         # Check if folder exists
         try:
             validate_folder(path)
@@ -53,10 +148,43 @@ class Templating:
             logging.error(errormsg)
             raise FileNotFoundError(errormsg)
         
+        if isinstance(bytecode_cache, str):
+            os.makedirs(bytecode_cache, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache)
+
+        loader = FileSystemLoader(path)
+        self._manifest = None
+        if precompiled is not None:
+            if not os.path.exists(precompiled):
+                errormsg = f"Precompiled templates {precompiled} do not exist"
+                logging.error(errormsg)
+                raise FileNotFoundError(errormsg)
+            self._manifest = _read_manifest(precompiled)
+            built_with = (self._manifest.get("jinja2"), self._manifest.get("enable_async"))
+            if built_with != (jinja2_version, enable_async):
+                errormsg = (
+                    f"Precompiled templates {precompiled} were built with Jinja2 {built_with[0]} "
+                    f"and enable_async={built_with[1]}, but this is Jinja2 {jinja2_version} with "
+                    f"enable_async={enable_async}. Compile them again"
+                )
+                logging.error(errormsg)
+                raise ValueError(errormsg)
+            loader = ChoiceLoader([ModuleLoader(precompiled), loader])
+
         # Establish the environment
-        self.env = Environment(
-            loader=FileSystemLoader(path), autoescape=select_autoescape(), undefined=StrictUndefined
+        self.env = _Environment(
+            loader=loader,
+            autoescape=select_autoescape(),
+            undefined=StrictUndefined,
+            bytecode_cache=bytecode_cache,
+            auto_reload=not production,
+            cache_size=-1 if production else 400,
+            enable_async=enable_async,
+            extensions=[_FragmentCacheExtension],
         )
+        self.env.fragment_cache = _FragmentCache(fragment_cache_size)
+        if profile:
+            self.env.profiler = _Profiler(profile if callable(profile) else None)
         
     def list_templates(self) -> list[str]:
         """Returns a list of templates in the folder
@@ -64,8 +192,64 @@ class Templating:
         Returns:
             list[str]: A list of strings containing the template names
         """
+        if self._manifest is not None:
+            # A ModuleLoader can not list its templates
+            sources = self.env.loader.loaders[1].list_templates()
+            return sorted(set(self._manifest["templates"]) | set(sources))
         return self.env.list_templates()
 
+    def compile_templates(self, target: str, zip: bool = True) -> list[str]:
+        """Compile every template in the folder to Python modules, for a
+        Templating created with precompiled=target to load without parsing. A
+        manifest listing the templates, the Jinja2 version and enable_async is
+        stored with them, and a Templating only loads them with the same
+        version and enable_async
+
+        Args:
+            target (str): The zip file or folder to write
+            zip (bool): Write a zip file rather than a folder. Defaults to True
+
+        Returns:
+            list[str]: The templates that could not be compiled, and are left out
+        """
+        failed = self.precompile()
+        self.env.compile_templates(
+            target,
+            zip="deflated" if zip else None,
+            filter_func=lambda name: name not in failed,
+            ignore_errors=False,
+        )
+
+        templates = [template for template in self.list_templates() if template not in failed]
+        manifest = json.dumps(
+            {"jinja2": jinja2_version, "enable_async": self.env.is_async, "templates": templates},
+            indent=2,
+        )
+        if zip:
+            with zipfile.ZipFile(target, "a") as archive:
+                archive.writestr(_MANIFEST, manifest)
+        else:
+            with open(os.path.join(target, _MANIFEST), "w") as f:
+                f.write(manifest)
+        logging.info(f"Compiled {len(templates)} templates to {target}")
+        return failed
+
+    def precompile(self) -> list[str]:
+        """Compile every template in the folder, so that later renders, and
+        other processes using the same bytecode cache, do not have to
+
+        Returns:
+            list[str]: The templates that could not be compiled
+        """
+        failed = []
+        for template in self.list_templates():
+            try:
+                self._get_template(template)
+            except Exception as e:
+                logging.error(f"Could not compile {template}: {e}")
+                failed.append(template)
+        return failed
+
     def load_template(self, template: str) -> object:
         """Loads a template from the folder
 
@@ -78,15 +262,48 @@ class Templating:
         Returns:
             object: The template object
         """
-        # Check if template exists
         try:
-            validate_file(os.path.join(self.path, template))
-        except FileNotFoundError:
+            return self._get_template(template)
+        except TemplateNotFound:
             errormsg = f"Template {template} not found in {self.path}"
             logging.error(errormsg)
             raise FileNotFoundError(errormsg)
 
-        return self.env.get_template(template)
+    def invalidate(self, template: str = None) -> None:
+        """Forget a loaded template, or all of them, so that it is read from the
+        folder again, together with its cached parts. Only needed in production
+        mode or to drop cached parts
+
+        Args:
+            template (str, optional): The file name of the template. Defaults to
+                None (all templates)
+        """
+        self.env.fragment_cache.clear(template)
+        if template is None:
+            self._templates.clear()
+            self.env.cache.clear()
+            return
+        self._templates.pop(template, None)
+        for key in [key for key in self.env.cache.keys() if key[1] == template]:
+            del self.env.cache[key]
+
+    @property
+    def fragment_cache_stats(self) -> dict:
+        """Returns the "hits", "misses" and number of "entries" of the {% cache %} parts"""
+        return self.env.fragment_cache.stats
+
+    def _get_template(self, template) -> Template:
+        """Returns the template, from the resolved templates in production mode"""
+        if isinstance(template, Template):
+            return template
+        if self.production:
+            loaded = self._templates.get(template)
+            if loaded is not None:
+                return loaded
+        loaded = self.env.get_template(template)
+        if self.production:
+            self._templates[template] = loaded
+        return loaded
 
     def render(self, template: str, **kwargs) -> str:
         """Render a template with the given arguments and return a string
@@ -101,20 +318,50 @@ class Templating:
         Returns:
             str: The rendered template
         """
-        template = self.env.get_template(template)
+        template = self._get_template(template)
+        kwargs, blocks = self._profiled(kwargs)
+        start = time.perf_counter()
         try:
-            return template.render(**kwargs)
+            rendered = template.render(**kwargs)
         except Exception as e:
             errormsg = f"Could not render {template}: {e}"
             logging.error(errormsg)
             raise Exception(errormsg)
+        if blocks is not None:
+            self.env.profiler.record_render(template.name, time.perf_counter() - start, len(rendered), blocks)
+        return rendered
     
-    def render_to_file(self, template: str, file: str, **kwargs) -> None:
-        """Render a template with the given arguments and write to a file
+    def render_stream(
+        self, template: str, stream_buffer_size: int = 65536, gzip_output: bool = False, **kwargs
+    ):
+        """Render a template piece by piece, so that large outputs never have to
+        fit in memory. Useful to send the output to a socket or an HTTP response
 
         Args:
             template (str): The file name of the template to load
-            file (str): The path and file name of the file to write to
+            stream_buffer_size (int): The approximate number of characters per
+                chunk. Defaults to 65536
+            gzip_output (bool): Yield the output gzip compressed, as bytes. Defaults to False
+            **kwargs: The arguments to pass to the template
+
+        Raises:
+            Exception: If the template could not be rendered, while iterating
+
+        Returns:
+            Iterator[str | bytes]: The rendered template in chunks
+        """
+        chunks = self._generate(self._get_template(template), stream_buffer_size, kwargs)
+        return self._gzip(chunks) if gzip_output else chunks
+
+    def render_to_file(self, template: str, file, gzip_output: bool = False, **kwargs) -> None:
+        """Render a template with the given arguments and write to a file. The
+        output is streamed, so it is never held in memory as a whole
+
+        Args:
+            template (str): The file name of the template to load
+            file (str | file-like object): The path and file name of the file to
+                write to, or an open file (text or binary) to write into
+            gzip_output (bool): Gzip compress the output. Defaults to False
             **kwargs: The arguments to pass to the template
         
         Raises:
@@ -124,5 +371,458 @@ class Templating:
         Returns:
             None: None            
         """
-        with open(file, "w") as f:
-            f.write(self.render(template, **kwargs))
+        if not hasattr(file, "write"):
+            with (gzip.open(file, "wb") if gzip_output else open(file, "w")) as f:
+                self.render_to_file(template, f, gzip_output=False, **kwargs)
+            return
+
+        if gzip_output:
+            with gzip.GzipFile(fileobj=file, mode="wb") as f:
+                self.render_to_file(template, f, gzip_output=False, **kwargs)
+            return
+
+        binary = not isinstance(file, io.TextIOBase)
+        for chunk in self.render_stream(template, **kwargs):
+            file.write(chunk.encode("utf-8") if binary else chunk)
+
+    async def render_async(self, template: str, **kwargs) -> str:
+        """Render a template with the given arguments, awaiting the async
+        functions it calls. Requires enable_async
+
+        Args:
+            template (str): The file name of the template to load
+            **kwargs: The arguments to pass to the template
+
+        Raises:
+            RuntimeError: If the object was not created with enable_async
+            Exception: If the template could not be rendered
+
+        Returns:
+            str: The rendered template
+        """
+        self._require_async()
+        template = self._get_template(template)
+        kwargs, blocks = self._profiled(kwargs)
+        start = time.perf_counter()
+        try:
+            rendered = await template.render_async(**kwargs)
+        except Exception as e:
+            errormsg = f"Could not render {template}: {e}"
+            logging.error(errormsg)
+            raise Exception(errormsg)
+        if blocks is not None:
+            self.env.profiler.record_render(template.name, time.perf_counter() - start, len(rendered), blocks)
+        return rendered
+
+    async def render_stream_async(
+        self, template: str, stream_buffer_size: int = 65536, gzip_output: bool = False, **kwargs
+    ):
+        """Render a template piece by piece like render_stream, as an async
+        iterator. Requires enable_async
+
+        Args:
+            template (str): The file name of the template to load
+            stream_buffer_size (int): The approximate number of characters per
+                chunk. Defaults to 65536
+            gzip_output (bool): Yield the output gzip compressed, as bytes. Defaults to False
+            **kwargs: The arguments to pass to the template
+
+        Raises:
+            RuntimeError: If the object was not created with enable_async
+            Exception: If the template could not be rendered, while iterating
+
+        Returns:
+            AsyncIterator[str | bytes]: The rendered template in chunks
+        """
+        self._require_async()
+        template = self._get_template(template)
+        compressor = zlib.compressobj(wbits=31) if gzip_output else None
+        kwargs, blocks = self._profiled(kwargs)
+        parts = template.generate_async(**kwargs)
+        if blocks is not None:
+            parts = _timed_async(parts, self._render_recorder(template, blocks))
+        buffer, size = [], 0
+        try:
+            async for part in parts:
+                buffer.append(part)
+                size += len(part)
+                if size < stream_buffer_size:
+                    continue
+                chunk = "".join(buffer)
+                buffer, size = [], 0
+                if compressor is None:
+                    yield chunk
+                elif data := compressor.compress(chunk.encode("utf-8")):
+                    yield data
+        except Exception as e:
+            errormsg = f"Could not render {template}: {e}"
+            logging.error(errormsg)
+            raise Exception(errormsg)
+        chunk = "".join(buffer)
+        if compressor is None:
+            if chunk:
+                yield chunk
+        else:
+            yield compressor.compress(chunk.encode("utf-8")) + compressor.flush()
+
+    def profile_summary(self) -> dict:
+        """Returns the totals recorded per template since the object was created
+
+        Returns:
+            dict: For each template, the number of "compiles" and "renders", the
+                "compile_seconds" and "render_seconds", the output "size" in
+                characters and, in "blocks", the render seconds per block.
+                Empty unless profile is enabled
+        """
+        return self.env.profiler.summary() if self.env.profiler is not None else {}
+
+    def profile_report(self) -> str:
+        """Returns the profile summary as a table, with the templates and their
+        blocks ordered by render time
+
+        Returns:
+            str: The report
+        """
+        lines = [f"{'template':<40} {'renders':>8} {'render s':>10} {'avg ms':>9} {'size':>12} {'compile s':>10}"]
+        summary = self.profile_summary()
+        for name, entry in sorted(summary.items(), key=lambda item: -item[1]["render_seconds"]):
+            average = entry["render_seconds"] / entry["renders"] * 1000 if entry["renders"] else 0.0
+            lines.append(
+                f"{name:<40} {entry['renders']:8d} {entry['render_seconds']:10.3f} {average:9.2f} "
+                f"{entry['size']:12d} {entry['compile_seconds']:10.3f}"
+            )
+            for block, seconds in sorted(entry["blocks"].items(), key=lambda item: -item[1]):
+                lines.append(f"  block {block:<32} {'':>8} {seconds:10.3f}")
+        return "\n".join(lines)
+
+    def _profiled(self, kwargs: dict) -> tuple:
+        """Returns the arguments with a dict for the block timings added, and
+        that dict, when profiling"""
+        if self.env.profiler is None:
+            return kwargs, None
+        blocks = {}
+        return {**kwargs, _PROFILE_BLOCKS: blocks}, blocks
+
+    def _render_recorder(self, template: Template, blocks: dict):
+        return lambda seconds, size: self.env.profiler.record_render(template.name, seconds, size, blocks)
+
+    def _require_async(self) -> None:
+        if not self.env.is_async:
+            errormsg = "Async rendering requires a Templating created with enable_async=True"
+            logging.error(errormsg)
+            raise RuntimeError(errormsg)
+
+    def render_many(
+        self,
+        template: str,
+        contexts: list[dict],
+        output_paths: list[str],
+        workers: int = None,
+        gzip_output: bool = False,
+    ) -> list[dict]:
+        """Render a template once per context into its own file, spread over a
+        pool of processes, since rendering is CPU bound. Every process sets up
+        its own Templating in production mode with the options of this one, so
+        the template is compiled once per process (or loaded from the bytecode
+        cache or the precompiled templates). The contexts, and a profile
+        function, must be picklable. Profile records are made in the worker
+        processes, so they are passed to a profile function but do not show up
+        in profile_summary() of this object
+
+        Args:
+            template (str): The file name of the template
+            contexts (list[dict]): The arguments to pass to the template, one per file
+            output_paths (list[str]): The files to write, one per context
+            workers (int, optional): The number of processes, 1 renders in this
+                process. Defaults to None (the number of CPUs)
+            gzip_output (bool): Gzip compress the files. Defaults to False
+
+        Raises:
+            ValueError: If there are not as many output paths as contexts
+            FileNotFoundError: If the template does not exist
+
+        Returns:
+            list[dict]: For each context, the "path" written, the "seconds" it
+                took and the "error" if it failed, or None
+        """
+        if len(contexts) != len(output_paths):
+            errormsg = f"Got {len(contexts)} contexts but {len(output_paths)} output paths"
+            logging.error(errormsg)
+            raise ValueError(errormsg)
+        name = self.load_template(template).name
+        items = [(name, context, path, gzip_output) for context, path in zip(contexts, output_paths)]
+
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(items) <= 1:
+            results = [_render_item(item, self) for item in items]
+        else:
+            # Only a folder can be handed to the worker processes
+            options = dict(
+                bytecode_cache=self._bytecode_cache if isinstance(self._bytecode_cache, str) else None,
+                enable_async=self.env.is_async,
+                precompiled=self._precompiled,
+                fragment_cache_size=self.env.fragment_cache.max_entries,
+                profile=self._profile,
+            )
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.path, options)) as executor:
+                chunksize = max(1, len(items) // (workers * 4))
+                results = list(executor.map(_render_item, items, chunksize=chunksize))
+
+        failed = sum(1 for result in results if result["error"] is not None)
+        logging.info(f"Rendered {len(results) - failed} of {len(results)} files from {name}")
+        return results
+
+    def _generate(self, template, buffer_size: int, kwargs: dict):
+        kwargs, blocks = self._profiled(kwargs)
+        parts = template.generate(**kwargs)
+        if blocks is not None:
+            parts = _timed(parts, self._render_recorder(template, blocks))
+        buffer, size = [], 0
+        try:
+            for part in parts:
+                buffer.append(part)
+                size += len(part)
+                if size >= buffer_size:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+        except Exception as e:
+            errormsg = f"Could not render {template}: {e}"
+            logging.error(errormsg)
+            raise Exception(errormsg)
+        if buffer:
+            yield "".join(buffer)
+
+    @staticmethod
+    def _gzip(chunks):
+        compressor = zlib.compressobj(wbits=31)
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode("utf-8"))
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+# The template variable holding the block timings of a profiled render
+_PROFILE_BLOCKS = "_templating_profile_blocks"
+_instrument_lock = threading.Lock()
+
+
+class _Environment(Environment):
+    """An Environment that records compile times, and times the blocks of the
+    templates it loads, when it has a profiler"""
+
+    profiler = None
+
+    def compile(self, source, name=None, filename=None, raw=False, defer_init=False):
+        if self.profiler is None:
+            return super().compile(source, name, filename, raw, defer_init)
+        start = time.perf_counter()
+        code = super().compile(source, name, filename, raw, defer_init)
+        self.profiler.record(
+            {"event": "compile", "template": name or "<string>", "seconds": time.perf_counter() - start}
+        )
+        return code
+
+    def get_template(self, name, parent=None, globals=None) -> Template:
+        template = super().get_template(name, parent, globals)
+        if self.profiler is not None:
+            _instrument(template)
+        return template
+
+
+def _instrument(template: Template) -> None:
+    """Wrap the block functions of the template to add their time to the
+    block timings of the render, if it is profiled"""
+    with _instrument_lock:
+        if getattr(template, "_profiled", False):
+            return
+        for name, render_block in list(template.blocks.items()):
+            template.blocks[name] = _timed_block(name, render_block)
+        template._profiled = True
+
+
+def _timed_block(name: str, render_block):
+    def timed(context):
+        parts = render_block(context)
+        timings = context.get(_PROFILE_BLOCKS)
+        if timings is None:
+            return parts
+
+        def done(seconds, size):
+            timings[name] = timings.get(name, 0.0) + seconds
+
+        return _timed_async(parts, done) if inspect.isasyncgen(parts) else _timed(parts, done)
+
+    return timed
+
+
+def _timed(parts, done):
+    """Pass on the parts, then call done with the time spent producing them,
+    not counting the time the consumer took, and their total length"""
+    seconds, size = 0.0, 0
+    start = time.perf_counter()
+    for part in parts:
+        seconds += time.perf_counter() - start
+        size += len(part)
+        yield part
+        start = time.perf_counter()
+    done(seconds + time.perf_counter() - start, size)
+
+
+async def _timed_async(parts, done):
+    seconds, size = 0.0, 0
+    start = time.perf_counter()
+    async for part in parts:
+        seconds += time.perf_counter() - start
+        size += len(part)
+        yield part
+        start = time.perf_counter()
+    done(seconds + time.perf_counter() - start, size)
+
+
+class _Profiler:
+    """Totals the compile and render records per template and passes every
+    record on to the callback"""
+
+    def __init__(self, callback: Callable[[dict], None] = None) -> None:
+        self.callback = callback
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def record_render(self, template: str, seconds: float, size: int, blocks: dict) -> None:
+        self.record(
+            {
+                "event": "render",
+                "template": template or "<string>",
+                "seconds": seconds,
+                "size": size,
+                "blocks": dict(blocks),
+            }
+        )
+
+    def record(self, record: dict) -> None:
+        with self._lock:
+            entry = self._templates.setdefault(
+                record["template"],
+                {"compiles": 0, "compile_seconds": 0.0, "renders": 0, "render_seconds": 0.0, "size": 0, "blocks": {}},
+            )
+            if record["event"] == "compile":
+                entry["compiles"] += 1
+                entry["compile_seconds"] += record["seconds"]
+            else:
+                entry["renders"] += 1
+                entry["render_seconds"] += record["seconds"]
+                entry["size"] += record["size"]
+                for block, seconds in record["blocks"].items():
+                    entry["blocks"][block] = entry["blocks"].get(block, 0.0) + seconds
+        if self.callback is not None:
+            try:
+                self.callback(record)
+            except Exception as e:
+                logging.error(f"Template profile callback failed: {e}")
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: {**entry, "blocks": dict(entry["blocks"])} for name, entry in self._templates.items()}
+
+
+class _FragmentCache:
+    """A thread-safe LRU of rendered template parts, keyed on the template
+    name and the key given to the cache tag"""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def get(self, key: tuple):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: tuple, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, template: str = None) -> None:
+        with self._lock:
+            if template is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == template]:
+                del self._entries[key]
+
+
+class _FragmentCacheExtension(Extension):
+    """Adds {% cache key %}...{% endcache %}, rendering the enclosed part once
+    per template and key and taking it from the environment's fragment_cache
+    afterwards"""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.Const(parser.name), parser.parse_expression()]
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(self.call_method("_cached", args), [], [], body).set_lineno(lineno)
+
+    def _cached(self, template: str, key, caller):
+        cache = self.environment.fragment_cache
+        value = cache.get((template, key))
+        if value is not None:
+            return value
+        if self.environment.is_async:
+            return self._cached_async(cache, (template, key), caller)
+        value = caller()
+        cache.set((template, key), value)
+        return value
+
+    async def _cached_async(self, cache: _FragmentCache, key: tuple, caller):
+        value = await caller()
+        cache.set(key, value)
+        return value
+
+
+_MANIFEST = "manifest.json"
+
+
+def _read_manifest(precompiled: str) -> dict:
+    if os.path.isdir(precompiled):
+        with open(os.path.join(precompiled, _MANIFEST), "r") as f:
+            return json.load(f)
+    with zipfile.ZipFile(precompiled) as archive:
+        return json.loads(archive.read(_MANIFEST))
+
+
+_worker_templating = None
+
+
+def _init_worker(path: str, options: dict) -> None:
+    global _worker_templating
+    _worker_templating = Templating(path, production=True, **options)
+
+
+def _render_item(item: tuple, templating: Templating = None) -> dict:
+    template, context, path, gzip_output = item
+    start = time.perf_counter()
+    error = None
+    try:
+        (templating or _worker_templating).render_to_file(template, path, gzip_output=gzip_output, **context)
+    except Exception as e:
+        error = str(e)
+    return {"path": path, "seconds": time.perf_counter() - start, "error": error}
@@ -1,9 +1,13 @@
+import builtins
+import os
 import pytest
+import queue
 import smtplib
 import logging
+from email import message_from_bytes
 from pydantic import ValidationError
 
-from pyprediktorutilities.send_email import SendEmail
+from pyprediktorutilities.send_email import EmailQueue, SendEmail
 
 srv = "smtp.gmail.com"
 port = 587
@@ -65,3 +69,230 @@ def test_mocked_send_email_forced_fail(mocker):
     mock_SMTP.side_effect = smtplib.SMTPException
     with pytest.raises(smtplib.SMTPException):
         SendEmail(srv, port, usr, pwd).send_email(sndr, rcpts, subj, body)
+
+
+def test_send_email_without_session_connects_per_email(mocker):
+    mock_SMTP = mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    server = mock_SMTP.return_value
+    server.__enter__.return_value = server
+    email = SendEmail(srv, port, usr, pwd)
+    email.send_email(sndr, rcpts, subj, body)
+    email.send_email(sndr, rcpts, subj, body)
+    assert mock_SMTP.call_count == 2
+    assert server.starttls.call_count == 2
+    assert server.login.call_count == 2
+    assert server.sendmail.call_count == 2
+    assert server.__exit__.call_count == 2
+
+
+def test_send_email_session_reuses_connection(mocker):
+    mock_SMTP = mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    with SendEmail(srv, port, usr, pwd) as email:
+        email.send_email(sndr, rcpts, subj, body)
+        email.send_email(sndr, rcpts, subj, body)
+    assert mock_SMTP.call_count == 1
+    server = mock_SMTP.return_value
+    server.login.assert_called_once_with(usr, pwd)
+    assert server.sendmail.call_count == 2
+    server.quit.assert_called_once()
+
+
+def test_send_email_session_reconnects_on_disconnect(mocker):
+    mock_SMTP = mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    dropped, fresh = mocker.MagicMock(), mocker.MagicMock()
+    dropped.sendmail.side_effect = smtplib.SMTPServerDisconnected
+    mock_SMTP.side_effect = [dropped, fresh]
+    with SendEmail(srv, port, usr, pwd) as email:
+        email.send_email(sndr, rcpts, subj, body)
+    fresh.sendmail.assert_called_once()
+
+
+def test_send_bulk_collects_failures_and_throttles(mocker):
+    mock_SMTP = mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    server = mock_SMTP.return_value
+    server.sendmail.side_effect = [None, smtplib.SMTPRecipientsRefused({}), None]
+    sleep = mocker.patch("pyprediktorutilities.send_email.time.sleep")
+    messages = [dict(from_email=sndr, recipients=rcpts, subject=subj, body=body)] * 3
+
+    results = SendEmail(srv, port, usr, pwd).send_bulk(messages, rate=10)
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], smtplib.SMTPRecipientsRefused)
+    assert mock_SMTP.call_count == 1
+    server.login.assert_called_once()
+    assert sleep.call_count == 2
+    server.quit.assert_called_once()
+
+
+def test_email_queue_sends_in_background(mocker):
+    mock_SMTP = mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    with EmailQueue(SendEmail(srv, port, usr, pwd), workers=2) as outbox:
+        for _ in range(5):
+            outbox.submit(sndr, rcpts, subj, body)
+        outbox.flush()
+        assert outbox.sent == 5
+    assert mock_SMTP.call_count <= 2
+    assert mock_SMTP.return_value.sendmail.call_count == 5
+
+
+def test_email_queue_validates_on_submit(mocker):
+    mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    with EmailQueue(SendEmail(srv, port, usr, pwd)) as outbox:
+        with pytest.raises(ValueError):
+            outbox.submit(sndr, [], subj, body)
+        with pytest.raises(ValidationError):
+            outbox.submit("not an email", rcpts, subj, body)
+
+
+def test_email_queue_retries_transient_failures(mocker):
+    mock_SMTP = mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    mock_SMTP.return_value.sendmail.side_effect = [
+        smtplib.SMTPResponseException(421, "Try again later"),
+        smtplib.SMTPResponseException(550, "No such user"),
+    ]
+    with EmailQueue(SendEmail(srv, port, usr, pwd), workers=1, backoff=0) as outbox:
+        message_id = outbox.submit(sndr, rcpts, subj, body)
+        outbox.flush()
+        assert mock_SMTP.return_value.sendmail.call_count == 2
+        assert outbox.failed[message_id].smtp_code == 550
+        assert outbox.sent == 0
+
+
+def test_email_queue_recovers_spooled_messages(mocker, tmp_path):
+    mock_SMTP = mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    outbox = EmailQueue(SendEmail(srv, port, usr, pwd), workers=0, spool_directory=str(tmp_path))
+    outbox.submit(sndr, rcpts, subj, body)
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+    with EmailQueue(SendEmail(srv, port, usr, pwd), spool_directory=str(tmp_path)) as outbox:
+        outbox.flush()
+        assert outbox.sent == 1
+    mock_SMTP.return_value.sendmail.assert_called_once()
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def streaming_server(mocker):
+    """A mock server that accepts every streamed message"""
+    server = mocker.MagicMock()
+    server.__enter__.return_value = server
+    server.mail.return_value = server.rcpt.return_value = (250, b"OK")
+    server.docmd.return_value = (354, b"Go ahead")
+    server.getreply.return_value = (250, b"Queued")
+    return server
+
+
+def smtp_server(mocker):
+    """Patch smtplib.SMTP with a server that accepts every streamed message"""
+    server = streaming_server(mocker)
+    mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP", return_value=server)
+    return server
+
+
+def test_send_email_streams_attachments(mocker, tmp_path):
+    attachment = tmp_path / "report.bin"
+    attachment.write_bytes(os.urandom(200_000))
+    server = smtp_server(mocker)
+    email = SendEmail(srv, port, usr, pwd)
+
+    email.send_email(sndr, rcpts, subj, ".leading dot", [str(attachment)])
+
+    server.sendmail.assert_not_called()
+    blocks = [c.args[0] for c in server.send.call_args_list]
+    assert len(blocks) > 3
+    data = b"".join(blocks)
+    assert data.endswith(b"\r\n.\r\n")
+    message = message_from_bytes(data[: -len(b".\r\n")].replace(b"\r\n..", b"\r\n."))
+    text, part = message.get_payload()
+    assert text.get_payload(decode=True) == b".leading dot"
+    assert part.get_filename() == "report.bin"
+    assert part.get_payload(decode=True) == attachment.read_bytes()
+
+
+def test_send_email_caches_encoded_attachments(mocker, tmp_path):
+    attachment = tmp_path / "report.txt"
+    attachment.write_text("first")
+    smtp_server(mocker)
+    opened = mocker.spy(builtins, "open")
+    email = SendEmail(srv, port, usr, pwd)
+
+    email.send_email(sndr, rcpts, subj, body, [str(attachment)])
+    assert len(email._attachments) == 0
+    email.send_email(sndr, rcpts, subj, body, [str(attachment)])
+    email.send_email(sndr, rcpts, subj, body, [str(attachment)])
+    assert opened.call_count == 2
+    assert len(email._attachments) == 1
+
+    attachment.write_text("second, changed")
+    os.utime(attachment, ns=(0, 0))
+    email.send_email(sndr, rcpts, subj, body, [str(attachment)])
+    email.send_email(sndr, rcpts, subj, body, [str(attachment)])
+    assert opened.call_count == 4
+    assert len(email._attachments) == 2
+
+
+def test_email_queue_full_submit_is_not_spooled(mocker, tmp_path):
+    mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+    outbox = EmailQueue(SendEmail(srv, port, usr, pwd), workers=0, maxsize=1, spool_directory=str(tmp_path))
+    outbox.submit(sndr, rcpts, subj, body)
+    with pytest.raises(queue.Full):
+        outbox.submit(sndr, rcpts, subj, body, timeout=0.1)
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+
+def failing_attachment(mocker, email):
+    """Make reading attachments fail after the first block has been sent"""
+    def encode(file):
+        yield b"QUJD\r\n"
+        raise OSError("Read error")
+    mocker.patch.object(email._attachments, "_encode", side_effect=encode)
+
+
+def closable_smtp_servers(mocker):
+    """Patch smtplib.SMTP with servers that accept streamed messages until closed"""
+    servers = []
+
+    def connect(*args):
+        server = streaming_server(mocker)
+
+        def close():
+            disconnected = smtplib.SMTPServerDisconnected("please run connect() first")
+            server.mail.side_effect = server.sendmail.side_effect = disconnected
+
+        server.close.side_effect = close
+        servers.append(server)
+        return server
+
+    mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP", side_effect=connect)
+    return servers
+
+
+def test_send_email_session_recovers_from_failed_attachment(mocker, tmp_path):
+    attachment = tmp_path / "report.bin"
+    attachment.write_bytes(b"data")
+    servers = closable_smtp_servers(mocker)
+    with SendEmail(srv, port, usr, pwd, attachment_cache_size=0) as email:
+        failing_attachment(mocker, email)
+        with pytest.raises(OSError):
+            email.send_email(sndr, rcpts, subj, body, [str(attachment)])
+        servers[0].close.assert_called_once()
+        servers[0].getreply.assert_not_called()
+
+        email.send_email(sndr, rcpts, subj, body)
+    assert len(servers) == 2
+    servers[1].sendmail.assert_called_once()
+
+
+def test_send_bulk_continues_after_failed_attachment(mocker, tmp_path):
+    attachment = tmp_path / "report.bin"
+    attachment.write_bytes(b"data")
+    servers = closable_smtp_servers(mocker)
+    email = SendEmail(srv, port, usr, pwd, attachment_cache_size=0)
+    failing_attachment(mocker, email)
+    message = dict(from_email=sndr, recipients=rcpts, subject=subj, body=body)
+
+    results = email.send_bulk([dict(message, files=[str(attachment)]), message, message])
+
+    assert isinstance(results[0], OSError)
+    assert results[1:] == [None, None]
+    assert len(servers) == 2
+    assert servers[1].sendmail.call_count == 2
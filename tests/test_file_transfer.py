@@ -1,8 +1,18 @@
+import gzip
+import io
+import os
+import paramiko
 import pytest
+from unittest import mock
 import logging
 from pydantic import ValidationError
 
-from pyprediktorutilities.file_transfer import SFTPClient
+from pyprediktorutilities.file_transfer import (
+    SFTPClient,
+    SFTPUploadError,
+    TUNED_MAX_PACKET_SIZE,
+    TUNED_WINDOW_SIZE,
+)
 
 server = "someserver.somedomain.com"
 username = "username"
@@ -39,4 +49,300 @@ def test_sftp_client_with_missing_file():
 
 def test_sftp_client_with_nonexisting_file():
     with pytest.raises(FileNotFoundError):
-        SFTPClient(server=server, username=username, password=password, port=port).upload(files=["No_such_file"], remote_directory="/tmp")
\ No newline at end of file
+        SFTPClient(server=server, username=username, password=password, port=port).upload(files=["No_such_file"], remote_directory="/tmp")
+
+
+@pytest.fixture
+def local_files(tmp_path):
+    files = []
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        path = tmp_path / name
+        path.write_text(name)
+        files.append(str(path))
+    return files
+
+
+@pytest.fixture
+def mock_ssh(mocker):
+    ssh = mocker.MagicMock()
+    ssh.__enter__.return_value = ssh
+    ssh.open_sftp.return_value.__enter__.return_value = ssh.open_sftp.return_value
+    mocker.patch("pyprediktorutilities.file_transfer.paramiko.SSHClient", return_value=ssh)
+    return ssh
+
+
+def test_sftp_client_upload(local_files, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    uploaded = SFTPClient(server, username, password, port).upload(local_files, "/remote")
+    assert uploaded == ["/remote/a.txt", "/remote/b.txt", "/remote/c.txt"]
+    assert [c.args for c in sftp.put.call_args_list] == [
+        (file, f"/remote/{os.path.basename(file)}") for file in local_files
+    ]
+
+
+def test_sftp_client_upload_parallel_reports_progress(local_files, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    sftp.put.side_effect = lambda file, remote, callback=None: callback(1, 1)
+    progress = []
+    SFTPClient(server, username, password, port).upload(
+        local_files, "/remote", max_workers=3, progress=lambda *args: progress.append(args)
+    )
+    assert sorted(progress) == [(file, 1, 1) for file in local_files]
+    assert sftp.close.called
+
+
+def test_sftp_client_upload_aggregates_errors(local_files, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+
+    def put(file, remote, callback=None):
+        if file.endswith("b.txt"):
+            raise IOError("Permission denied")
+
+    sftp.put.side_effect = put
+    with pytest.raises(SFTPUploadError) as error:
+        SFTPClient(server, username, password, port).upload(local_files, "/remote", max_workers=2)
+    assert list(error.value.failed) == [local_files[1]]
+    assert error.value.transferred == ["/remote/a.txt", "/remote/c.txt"]
+    assert sftp.put.call_count == 3
+
+
+def test_sftp_client_reuses_persistent_connection(local_files, mocker):
+    ssh_class = mocker.patch("pyprediktorutilities.file_transfer.paramiko.SSHClient")
+    with SFTPClient(server, username, password, port) as client:
+        client.upload(local_files, "/remote")
+        client.upload(local_files, "/remote")
+    assert ssh_class.call_count == 1
+    ssh = ssh_class.return_value
+    ssh.connect.assert_called_once()
+    ssh.get_transport.return_value.set_keepalive.assert_called_with(30)
+    ssh.close.assert_called_once()
+
+
+def test_sftp_client_reconnects_dropped_connection(local_files, mocker):
+    ssh_class = mocker.patch("pyprediktorutilities.file_transfer.paramiko.SSHClient")
+    with SFTPClient(server, username, password, port) as client:
+        ssh_class.return_value.get_transport.return_value.is_active.return_value = False
+        client.upload(local_files, "/remote")
+    assert ssh_class.call_count == 2
+
+
+def test_sftp_client_closes_idle_connection(local_files, mocker):
+    ssh_class = mocker.patch("pyprediktorutilities.file_transfer.paramiko.SSHClient")
+    client = SFTPClient(server, username, password, port, idle_timeout=0.05)
+    client.connect()
+    client._idle_timer.join()
+    ssh_class.return_value.close.assert_called_once()
+    client.upload(local_files, "/remote")
+    assert ssh_class.call_count == 2
+    client.close()
+
+
+def test_sftp_client_tuned_opens_channels_with_large_window(local_files, mock_ssh, mocker):
+    from_transport = mocker.patch("pyprediktorutilities.file_transfer.paramiko.SFTPClient.from_transport")
+    SFTPClient(server, username, password, port, tuned=True).upload(local_files, "/remote")
+    from_transport.assert_called_with(
+        mock_ssh.get_transport.return_value,
+        window_size=TUNED_WINDOW_SIZE,
+        max_packet_size=TUNED_MAX_PACKET_SIZE,
+    )
+    mock_ssh.open_sftp.assert_not_called()
+
+
+def test_sftp_client_upload_large_writes_chunks_at_offsets(tmp_path, mock_ssh):
+    file = tmp_path / "large.bin"
+    file.write_bytes(bytes(range(10)) * 10)
+    sftp = mock_ssh.open_sftp.return_value
+    sftp.stat.return_value.st_size = 100
+    remote = sftp.open.return_value.__enter__.return_value
+    progress = []
+
+    remote_path = SFTPClient(server, username, password, port).upload_large(
+        str(file), "/remote", chunk_size=30, max_workers=2, progress=lambda *args: progress.append(args)
+    )
+
+    assert remote_path == "/remote/large.bin"
+    assert sorted(c.args[0] for c in remote.seek.call_args_list) == [0, 30, 60, 90]
+    assert sum(len(c.args[0]) for c in remote.write.call_args_list) == 100
+    assert progress[-1] == (str(file), 100, 100)
+
+
+def test_sftp_client_upload_large_detects_size_mismatch(tmp_path, mock_ssh):
+    file = tmp_path / "large.bin"
+    file.write_bytes(b"x" * 10)
+    mock_ssh.open_sftp.return_value.stat.return_value.st_size = 5
+    with pytest.raises(IOError):
+        SFTPClient(server, username, password, port).upload_large(str(file), "/remote", chunk_size=4)
+
+
+def test_sftp_client_upload_skips_unchanged_files(local_files, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    stats = {file: os.stat(file) for file in local_files}
+    sftp.stat.side_effect = lambda path: (
+        stats[local_files[0]] if path.endswith("a.txt") else mock.Mock(st_size=0, st_mtime=0)
+    )
+    uploaded = SFTPClient(server, username, password, port).upload(
+        local_files, "/remote", skip_unchanged=True
+    )
+    assert uploaded == ["/remote/b.txt", "/remote/c.txt"]
+    assert sftp.put.call_count == 2
+    sftp.utime.assert_any_call("/remote/b.txt", (stats[local_files[1]].st_atime, stats[local_files[1]].st_mtime))
+
+
+def test_sftp_client_upload_resumes_partial_file(tmp_path, mock_ssh):
+    file = tmp_path / "partial.bin"
+    file.write_bytes(b"0123456789")
+    sftp = mock_ssh.open_sftp.return_value
+    sftp.stat.side_effect = [mock.Mock(), mock.Mock(st_size=4), mock.Mock(st_size=10)]
+    remote = sftp.open.return_value.__enter__.return_value
+
+    SFTPClient(server, username, password, port).upload([str(file)], "/remote", resume=True)
+
+    sftp.put.assert_not_called()
+    sftp.open.assert_called_with("/remote/partial.bin", "r+b")
+    remote.seek.assert_called_with(4)
+    assert b"".join(c.args[0] for c in remote.write.call_args_list) == b"456789"
+
+
+def test_sftp_client_upload_skips_files_in_checksum_manifest(local_files, mock_ssh, tmp_path):
+    sftp = mock_ssh.open_sftp.return_value
+    sftp.stat.side_effect = lambda path: mock.Mock(st_size=5, st_mtime=0)
+    manifest = str(tmp_path / "manifest.json")
+    client = SFTPClient(server, username, password, port)
+
+    assert len(client.upload(local_files, "/remote", skip_unchanged=True, manifest=manifest)) == 3
+    assert client.upload(local_files, "/remote", skip_unchanged=True, manifest=manifest) == []
+    with open(local_files[0], "w") as f:
+        f.write("other")
+    assert client.upload(local_files, "/remote", skip_unchanged=True, manifest=manifest) == ["/remote/a.txt"]
+
+
+def test_sftp_client_creates_remote_directory_recursively(local_files, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    existing = {"/", "/data"}
+
+    def stat(path):
+        if path not in existing:
+            raise FileNotFoundError(path)
+
+    sftp.stat.side_effect = stat
+    sftp.mkdir.side_effect = existing.add
+    SFTPClient(server, username, password, port).upload(local_files, "/data/drop/daily")
+    assert [c.args[0] for c in sftp.mkdir.call_args_list] == ["/data/drop", "/data/drop/daily"]
+
+
+def test_sftp_client_download(mock_ssh, tmp_path):
+    sftp = mock_ssh.open_sftp.return_value
+    downloaded = SFTPClient(server, username, password, port).download(
+        ["/remote/a.txt", "/remote/b.txt"], str(tmp_path), max_workers=2
+    )
+    assert downloaded == [str(tmp_path / "a.txt"), str(tmp_path / "b.txt")]
+    assert sorted(c.args[:2] for c in sftp.get.call_args_list) == [
+        ("/remote/a.txt", str(tmp_path / "a.txt")),
+        ("/remote/b.txt", str(tmp_path / "b.txt")),
+    ]
+
+
+def test_sftp_client_sync_up_uploads_changed_files_only(tmp_path, mock_ssh):
+    (tmp_path / "sub").mkdir()
+    for name in ["same.txt", "changed.txt", "sub/new.txt", "skip.log"]:
+        (tmp_path / name).write_text(name)
+    same = os.stat(tmp_path / "same.txt")
+    sftp = mock_ssh.open_sftp.return_value
+    listing = {
+        "/remote/": [
+            paramiko.SFTPAttributes.from_stat(same, "same.txt"),
+            paramiko.SFTPAttributes.from_stat(os.stat(tmp_path / "skip.log"), "changed.txt"),
+            paramiko.SFTPAttributes.from_stat(same, "extra.txt"),
+        ],
+    }
+    sftp.listdir_attr.side_effect = lambda path: listing[path]
+
+    uploaded = SFTPClient(server, username, password, port).sync_up(
+        str(tmp_path), "/remote", exclude=["*.log"], delete=True
+    )
+
+    assert uploaded == ["/remote/changed.txt", "/remote/sub/new.txt"]
+    sftp.remove.assert_called_once_with("/remote/extra.txt")
+    assert sftp.utime.call_count == 2
+
+
+def test_sftp_client_glob_filters():
+    assert SFTPClient._matches("sub/report.xlsx", include=["*.xlsx"])
+    assert not SFTPClient._matches("sub/report.csv", include=["*.xlsx"])
+    assert not SFTPClient._matches("tmp/report.xlsx", exclude=["tmp/*"])
+    assert SFTPClient._matches("report.xlsx", include=["*.xlsx"], exclude=["tmp/*"])
+
+
+@pytest.mark.parametrize(
+    "source",
+    [b"report data", "report data", io.BytesIO(b"report data"), iter([b"report ", "data"])],
+)
+def test_sftp_client_upload_fileobj(source, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    uploaded = []
+    sftp.putfo.side_effect = lambda fl, remote, file_size=0, callback=None: uploaded.append(fl.read())
+    remote_path = SFTPClient(server, username, password, port).upload_fileobj(source, "/remote/report.txt")
+    assert remote_path == "/remote/report.txt"
+    assert uploaded == [b"report data"]
+
+
+def test_sftp_client_upload_fileobj_compresses(mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    uploaded = []
+
+    def putfo(fl, remote, file_size=0, callback=None):
+        uploaded.append(b"".join(iter(lambda: fl.read(3), b"")))
+
+    sftp.putfo.side_effect = putfo
+    chunks = (b"x" * 1000 for _ in range(100))
+    SFTPClient(server, username, password, port).upload_fileobj(chunks, "/remote/data.gz", compress=True)
+    assert gzip.decompress(uploaded[0]) == b"x" * 100000
+
+
+def test_sftp_client_upload_fileobj_rejects_unsupported_source(mock_ssh):
+    with pytest.raises(TypeError):
+        SFTPClient(server, username, password, port).upload_fileobj(42, "/remote/data")
+
+
+def test_sftp_client_atomic_upload_publishes_batch_after_upload(local_files, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    calls = []
+    sftp.put.side_effect = lambda file, remote, callback=None: calls.append(("put", remote))
+    sftp.posix_rename.side_effect = lambda old, new: calls.append(("rename", old, new))
+
+    uploaded = SFTPClient(server, username, password, port).upload(local_files, "/remote", atomic=True)
+
+    assert uploaded == ["/remote/a.txt", "/remote/b.txt", "/remote/c.txt"]
+    assert calls == [
+        ("put", "/remote/.a.txt.part"),
+        ("put", "/remote/.b.txt.part"),
+        ("put", "/remote/.c.txt.part"),
+        ("rename", "/remote/.a.txt.part", "/remote/a.txt"),
+        ("rename", "/remote/.b.txt.part", "/remote/b.txt"),
+        ("rename", "/remote/.c.txt.part", "/remote/c.txt"),
+    ]
+
+
+def test_sftp_client_atomic_upload_publishes_nothing_on_failure(local_files, mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+
+    def put(file, remote, callback=None):
+        if file.endswith("b.txt"):
+            raise IOError("Disk full")
+
+    sftp.put.side_effect = put
+    with pytest.raises(SFTPUploadError) as error:
+        SFTPClient(server, username, password, port).upload(local_files, "/remote", atomic=True)
+    assert error.value.transferred == []
+    sftp.posix_rename.assert_not_called()
+    assert sorted(c.args[0] for c in sftp.remove.call_args_list) == [
+        "/remote/.a.txt.part",
+        "/remote/.c.txt.part",
+    ]
+
+
+def test_sftp_client_atomic_upload_fileobj(mock_ssh):
+    sftp = mock_ssh.open_sftp.return_value
+    SFTPClient(server, username, password, port).upload_fileobj(b"data", "/remote/data.bin", atomic=True)
+    assert sftp.putfo.call_args.args[1] == "/remote/.data.bin.part"
+    sftp.posix_rename.assert_called_once_with("/remote/.data.bin.part", "/remote/data.bin")
@@ -0,0 +1,78 @@
+import pytest
+
+from pyprediktorutilities.mail_merge import MailMerge
+from pyprediktorutilities.send_email import SendEmail
+from pyprediktorutilities.templating import Templating
+
+sndr = "nobody@somedomain.com"
+
+
+@pytest.fixture
+def templating(tmp_path):
+    (tmp_path / "report.txt").write_text("Hello {{ name }}, {{ plant }} produced {{ energy }} MWh")
+    return Templating(str(tmp_path))
+
+
+@pytest.fixture
+def mock_SMTP(mocker):
+    return mocker.patch("pyprediktorutilities.send_email.smtplib.SMTP")
+
+
+def test_mail_merge_sends_personalised_emails(templating, mock_SMTP):
+    merge = MailMerge(
+        templating, SendEmail("smtp", 587, "user", "pass"), "report.txt", "Report for {{ plant }}", sndr,
+        connections=2,
+    )
+    recipients = [
+        {"email": f"user{i}@somedomain.com", "name": f"User {i}", "plant": f"Plant {i}", "energy": i}
+        for i in range(20)
+    ]
+
+    report = merge.send(recipients)
+
+    assert report["sent"] == 20 and report["failed"] == 0
+    assert report["messages_per_second"] > 0
+    assert [r["recipients"] for r in report["results"]] == [[r["email"]] for r in recipients]
+    assert all(r["status"] == "sent" for r in report["results"])
+    assert mock_SMTP.call_count <= 2
+    server = mock_SMTP.return_value
+    messages = {c.args[1][0]: c.args[2] for c in server.sendmail.call_args_list}
+    assert "Subject: Report for Plant 7" in messages["user7@somedomain.com"]
+    assert "Hello User 7, Plant 7 produced 7 MWh" in messages["user7@somedomain.com"]
+
+
+def test_mail_merge_reports_failures_per_recipient(templating, mock_SMTP):
+    merge = MailMerge(templating, SendEmail("smtp", 587, "user", "pass"), "report.txt", "Report", sndr)
+    recipients = [
+        {"email": "ok@somedomain.com", "name": "A", "plant": "P", "energy": 1},
+        {"email": "missing@somedomain.com", "name": "B", "plant": "P"},
+        {"email": "not an email", "name": "C", "plant": "P", "energy": 1},
+    ]
+
+    report = merge.send(recipients)
+
+    assert report["sent"] == 1 and report["failed"] == 2
+    statuses = [r["status"] for r in report["results"]]
+    assert statuses == ["sent", "failed", "failed"]
+    assert "energy" in report["results"][1]["error"]
+    mock_SMTP.return_value.sendmail.assert_called_once()
+
+
+def test_mail_merge_missing_template(templating):
+    with pytest.raises(FileNotFoundError):
+        MailMerge(templating, SendEmail("smtp", 587, "user", "pass"), "missing.txt", "Report", sndr)
+
+
+def test_mail_merge_does_not_escape_the_subject(tmp_path, mock_SMTP):
+    (tmp_path / "report.html").write_text("<p>{{ plant }}</p>")
+    merge = MailMerge(
+        Templating(str(tmp_path)), SendEmail("smtp", 587, "user", "pass"), "report.html",
+        "Report for {{ plant }}", sndr,
+    )
+
+    report = merge.send([{"email": "user@somedomain.com", "plant": "R&D <Plant 1>"}])
+
+    assert report["sent"] == 1
+    message = mock_SMTP.return_value.sendmail.call_args.args[2]
+    assert "Subject: Report for R&D <Plant 1>" in message
+    assert "R&amp;D &lt;Plant 1&gt;" in message
@@ -1,9 +1,22 @@
+import gzip
+import json
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 import pytest
+import requests
 from pydantic import ValidationError
 
-from pyprediktorutilities.shared import request_from_api, validate_file
+from pyprediktorutilities.shared import (
+    RequestCoalescer,
+    ResponseCache,
+    paginate_from_api,
+    request_from_api,
+    stream_from_api,
+    validate_file,
+)
 
 URL = "http://someserver.somedomain.com/v1/"
 return_json = [
@@ -17,17 +30,44 @@ return_json = [
 ]
 
 
-# This method will be used by the mock to replace requests
-def mocked_requests(*args, **kwargs):
-    class MockResponse:
-        def __init__(self, json_data, status_code):
-            self.json_data = json_data
-            self.status_code = status_code
-            self.raise_for_status = mock.Mock(return_value=False)
+def make_response(content: bytes, content_type: str = "application/json") -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content
+    response.headers["Content-Type"] = content_type
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+class MockResponse:
+    def __init__(self, json_data, status_code, headers=None):
+        self.json_data = json_data
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.raise_for_status = mock.Mock(return_value=False)
+        self.content = json.dumps(json_data).encode()
+        self.encoding = "utf-8"
+
+    def json(self):
+        return self.json_data
+
+    @property
+    def links(self):
+        return {"next": {"url": self.headers["Link"]}} if "Link" in self.headers else {}
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def __enter__(self):
+        return self
 
-        def json(self):
-            return self.json_data
+    def __exit__(self, *args):
+        pass
 
+
+# This method will be used by the mock to replace requests
+def mocked_requests(*args, **kwargs):
     if args[0] == f"{URL}something":
         return MockResponse(return_json, 200)
 
@@ -55,6 +95,303 @@ class SharedFunctionsTestCase(unittest.TestCase):
         )
         assert result == return_json
 
+    @mock.patch("requests.get", return_value=MockResponse(return_json * 3, 200))
+    def test_stream_from_api_yields_array_elements(self, mock_get):
+        result = stream_from_api(rest_url=URL, method="GET", endpoint="something", chunk_size=7)
+        assert list(result) == return_json * 3
+        assert mock_get.call_args.kwargs["stream"] is True
+
+    @mock.patch("requests.get", return_value=MockResponse({"Values": return_json}, 200))
+    def test_stream_from_api_with_prefix(self, mock_get):
+        result = stream_from_api(
+            rest_url=URL, method="GET", endpoint="something", prefix="Values.item"
+        )
+        assert list(result) == return_json
+
+    def test_request_from_api_cache_honours_max_age(self):
+        cache = ResponseCache()
+        response = MockResponse(return_json, 200, {"Cache-Control": "max-age=60"})
+        with mock.patch("requests.get", return_value=response) as mock_get:
+            first = request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+            second = request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+        assert first == second == return_json
+        assert mock_get.call_count == 1
+        assert cache.stats == {"hits": 1, "misses": 1, "revalidations": 0}
+
+    def test_request_from_api_cache_revalidates_with_etag(self):
+        cache = ResponseCache()
+        responses = [
+            MockResponse(return_json, 200, {"ETag": '"abc"', "Cache-Control": "no-cache"}),
+            MockResponse(None, 304, {"ETag": '"abc"'}),
+        ]
+        with mock.patch("requests.get", side_effect=responses) as mock_get:
+            request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+            result = request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+        assert result == return_json
+        assert mock_get.call_args.kwargs["headers"]["If-None-Match"] == '"abc"'
+        assert cache.stats == {"hits": 0, "misses": 1, "revalidations": 1}
+
+    def test_request_from_api_cache_respects_no_store(self):
+        cache = ResponseCache()
+        response = MockResponse(return_json, 200, {"Cache-Control": "no-store, max-age=60"})
+        with mock.patch("requests.get", return_value=response) as mock_get:
+            request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+            request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+        assert mock_get.call_count == 2
+
+    def test_response_cache_key_depends_on_params_and_vary_headers(self):
+        cache = ResponseCache()
+        key = cache.key("GET", URL, {"a": 1}, {"Accept": "application/json"})
+        assert key == cache.key("GET", URL, {"a": 1}, {"accept": "application/json", "X-Trace": "1"})
+        assert key != cache.key("GET", URL, {"a": 2}, {"Accept": "application/json"})
+        assert key != cache.key("GET", URL, {"a": 1}, {"Accept": "text/csv"})
+
+    def test_response_cache_on_disk_survives_new_instance(self):
+        with tempfile.TemporaryDirectory() as directory:
+            response = MockResponse(return_json, 200, {"Cache-Control": "max-age=60"})
+            with mock.patch("requests.get", return_value=response):
+                request_from_api(
+                    rest_url=URL, method="GET", endpoint="something",
+                    cache=ResponseCache(directory=directory),
+                )
+            cache = ResponseCache(directory=directory)
+            with mock.patch("requests.get") as mock_get:
+                result = request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+            assert result == return_json
+            mock_get.assert_not_called()
+            assert cache.hits == 1
+
+    def test_response_cache_evicts_least_recently_used(self):
+        cache = ResponseCache(max_entries=1)
+        response = MockResponse(return_json, 200, {"Cache-Control": "max-age=60"})
+        with mock.patch("requests.get", return_value=response) as mock_get:
+            request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+            request_from_api(rest_url=URL, method="GET", endpoint="other", cache=cache)
+            request_from_api(rest_url=URL, method="GET", endpoint="something", cache=cache)
+        assert mock_get.call_count == 3
+
+    def test_paginate_from_api_by_offset(self):
+        items = list(range(25))
+
+        def paged(*args, params=None, **kwargs):
+            offset, limit = params["offset"], params["limit"]
+            return MockResponse(items[offset:offset + limit], 200)
+
+        with mock.patch("requests.get", side_effect=paged):
+            pages = list(
+                paginate_from_api(
+                    rest_url=URL, method="GET", endpoint="something", params={"q": "x"}, page_size=10
+                )
+            )
+        assert pages == [items[0:10], items[10:20], items[20:25]]
+
+    def test_paginate_from_api_by_offset_with_items_field(self):
+        def paged(*args, params=None, **kwargs):
+            count = 2 if params["offset"] == 0 else 1
+            return MockResponse({"Items": [params["offset"]] * count}, 200)
+
+        with mock.patch("requests.get", side_effect=paged):
+            pages = list(
+                paginate_from_api(
+                    rest_url=URL, method="GET", endpoint="something",
+                    page_size=2, items_field="Items", prefetch=0,
+                )
+            )
+        assert pages == [{"Items": [0, 0]}, {"Items": [2]}]
+
+    def test_paginate_from_api_by_offset_rejects_object_pages_without_items_field(self):
+        with mock.patch("requests.get", return_value=MockResponse({"Items": [1], "Total": 1}, 200)):
+            with pytest.raises(TypeError):
+                list(paginate_from_api(rest_url=URL, method="GET", endpoint="something", page_size=2))
+
+    def test_paginate_from_api_rejects_negative_prefetch(self):
+        with mock.patch("requests.get") as mock_get:
+            with pytest.raises(ValueError):
+                list(paginate_from_api(rest_url=URL, method="GET", endpoint="something", prefetch=-1))
+        mock_get.assert_not_called()
+
+    def test_paginate_from_api_by_token(self):
+        responses = {
+            None: MockResponse({"Items": [1], "continuationToken": "t1"}, 200),
+            "t1": MockResponse({"Items": [2], "continuationToken": None}, 200),
+        }
+
+        def paged(*args, params=None, **kwargs):
+            return responses[params.get("continuationToken")]
+
+        with mock.patch("requests.get", side_effect=paged):
+            pages = list(
+                paginate_from_api(rest_url=URL, method="GET", endpoint="something", pagination="token")
+            )
+        assert [p["Items"] for p in pages] == [[1], [2]]
+
+    def test_paginate_from_api_by_link_header(self):
+        responses = {
+            f"{URL}something": MockResponse([1], 200, {"Link": f"{URL}something?page=2"}),
+            f"{URL}something?page=2": MockResponse([2], 200),
+        }
+
+        with mock.patch("requests.get", side_effect=lambda url, **kwargs: responses[url]):
+            pages = list(
+                paginate_from_api(rest_url=URL, method="GET", endpoint="something", pagination="link")
+            )
+        assert pages == [[1], [2]]
+
+    def test_paginate_from_api_propagates_errors(self):
+        with mock.patch("requests.get", side_effect=ConnectionError("down")):
+            with pytest.raises(ConnectionError):
+                list(paginate_from_api(rest_url=URL, method="GET", endpoint="something", pagination="token"))
+
+    def test_request_from_api_coalesces_identical_concurrent_gets(self):
+        coalescer = RequestCoalescer()
+        release = threading.Event()
+        results = []
+
+        def slow_get(*args, **kwargs):
+            release.wait(timeout=5)
+            return MockResponse(return_json, 200)
+
+        def worker():
+            results.append(
+                request_from_api(rest_url=URL, method="GET", endpoint="something", coalescer=coalescer)
+            )
+
+        with mock.patch("requests.get", side_effect=slow_get) as mock_get:
+            threads = [threading.Thread(target=worker) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while coalescer.coalesced < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert coalescer.coalesced == 4
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        assert mock_get.call_count == 1
+        assert results == [return_json] * 5
+        assert results[0] is not results[1]
+
+    def test_request_from_api_invalid_json_raises_requests_error(self):
+        with mock.patch("requests.get", return_value=make_response(b"{not json")):
+            with pytest.raises(requests.exceptions.JSONDecodeError):
+                request_from_api(rest_url=URL, method="GET", endpoint="something")
+
+    def test_request_from_api_cached_invalid_json_raises_requests_error(self):
+        with mock.patch("requests.get", return_value=make_response(b"{not json")):
+            with pytest.raises(requests.exceptions.JSONDecodeError):
+                request_from_api(rest_url=URL, method="GET", endpoint="something", coalescer=RequestCoalescer())
+
+    def test_request_from_api_honours_declared_charset(self):
+        body = '{"name": "Bjørn"}'.encode("iso-8859-1")
+        response = make_response(body, "application/json; charset=iso-8859-1")
+        with mock.patch("requests.get", return_value=response):
+            assert request_from_api(rest_url=URL, method="GET", endpoint="something") == {"name": "Bjørn"}
+
+    def test_request_from_api_cached_and_coalesced_honour_declared_charset(self):
+        body = '{"name": "Bjørn"}'.encode("iso-8859-1")
+        response = make_response(body, "application/json; charset=iso-8859-1")
+        response.headers["Cache-Control"] = "max-age=60"
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch("requests.get", return_value=response) as mock_get:
+                for options in (
+                    {"cache": ResponseCache(directory=directory)},
+                    {"cache": ResponseCache(directory=directory)},
+                    {"coalescer": RequestCoalescer()},
+                ):
+                    result = request_from_api(rest_url=URL, method="GET", endpoint="something", **options)
+                    assert result == {"name": "Bjørn"}
+            assert mock_get.call_count == 2
+
+    def test_request_coalescer_shares_errors(self):
+        coalescer = RequestCoalescer()
+        with pytest.raises(ValueError):
+            coalescer.do("key", mock.Mock(side_effect=ValueError("failed")))
+        assert coalescer.do("key", lambda: 42) == 42
+
+    def test_request_coalescer_serves_stale_while_revalidating(self):
+        coalescer = RequestCoalescer(stale_while_revalidate=60)
+        assert coalescer.do("key", lambda: 1) == 1
+        refreshed = threading.Event()
+
+        def refresh():
+            refreshed.set()
+            return 2
+
+        assert coalescer.do("key", refresh) == 1
+        assert refreshed.wait(timeout=5)
+        deadline = time.monotonic() + 5
+        while coalescer.do("key", lambda: 3) != 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert coalescer.do("key", lambda: 3) == 2
+        assert coalescer.stale >= 2
+
+    def test_request_coalescer_forgets_expired_responses(self):
+        coalescer = RequestCoalescer(stale_while_revalidate=0.05)
+        for i in range(100):
+            coalescer.do(f"key{i}", lambda: i)
+        time.sleep(0.1)
+        assert coalescer.do("new", lambda: 1) == 1
+        assert list(coalescer._completed) == ["new"]
+
+    def test_request_coalescer_releases_waiters_on_base_exception(self):
+        coalescer = RequestCoalescer()
+        with pytest.raises(SystemExit):
+            coalescer.do("key", mock.Mock(side_effect=SystemExit))
+        assert coalescer.do("key", lambda: 42) == 42
+
+    @mock.patch("requests.post", side_effect=mocked_requests)
+    def test_request_from_api_gzip_compresses_data(self, mock_post):
+        result = request_from_api(
+            rest_url=URL, method="POST", endpoint="something", data="test" * 100, compress="gzip"
+        )
+        assert result == return_json
+        kwargs = mock_post.call_args.kwargs
+        assert kwargs["headers"]["Content-Encoding"] == "gzip"
+        assert gzip.decompress(kwargs["data"]) == b"test" * 100
+
+    @mock.patch("requests.post", side_effect=mocked_requests)
+    def test_request_from_api_streams_iterable_data(self, mock_post):
+        chunks = (f"chunk{i}".encode() for i in range(3))
+        request_from_api(rest_url=URL, method="POST", endpoint="something", data=chunks, compress="gzip")
+        sent = mock_post.call_args.kwargs["data"]
+        assert not isinstance(sent, bytes)
+        assert gzip.decompress(b"".join(sent)) == b"chunk0chunk1chunk2"
+
+    @mock.patch("requests.post", side_effect=mocked_requests)
+    def test_request_from_api_sends_bytes_uncompressed(self, mock_post):
+        request_from_api(rest_url=URL, method="POST", endpoint="something", data=b"raw")
+        kwargs = mock_post.call_args.kwargs
+        assert kwargs["data"] == b"raw"
+        assert "Content-Encoding" not in kwargs["headers"]
+
+    @mock.patch("requests.get", side_effect=mocked_requests)
+    def test_request_from_api_negotiates_response_encoding(self, mock_get):
+        request_from_api(rest_url=URL, method="GET", endpoint="something")
+        # Left to the requests default, which lists what urllib3 can decode
+        assert "Accept-Encoding" not in mock_get.call_args.kwargs["headers"]
+        assert "gzip" in requests.utils.default_headers()["Accept-Encoding"]
+        request_from_api(
+            rest_url=URL, method="GET", endpoint="something", headers={"Accept-Encoding": "identity"}
+        )
+        assert mock_get.call_args.kwargs["headers"]["Accept-Encoding"] == "identity"
+
+    def test_zstd_responses_are_accepted_when_decodable(self):
+        try:
+            import compression.zstd  # noqa: F401
+        except ImportError:
+            pytest.importorskip("backports.zstd")
+        assert "zstd" in requests.utils.default_headers()["Accept-Encoding"]
+
+    def test_request_from_api_zstd_compresses_data(self):
+        zstandard = pytest.importorskip("zstandard")
+        with mock.patch("requests.post", side_effect=mocked_requests) as mock_post:
+            request_from_api(
+                rest_url=URL, method="POST", endpoint="something", data="test", compress="zstd"
+            )
+        sent = mock_post.call_args.kwargs["data"]
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(sent) == b"test"
+
     def test_validate_file_with_non_existing_file(self):
         with pytest.raises(FileNotFoundError):
             validate_file(file="No_such_file")
@@ -1,6 +1,11 @@
+import asyncio
+import gzip
+import io
 import os
 import tempfile
+import time
 from unittest import TestCase, mock
+from jinja2 import Environment, FileSystemLoader
 from pyprediktorutilities.templating import Templating
 
 
@@ -72,3 +77,241 @@ class TestTemplating(TestCase):
             self.templating.render_to_file(template, f.name, title='Home')
             with open(f.name, 'r') as rendered_file:
                 self.assertEqual(rendered_file.read(), '<html><body>Home</body></html>')
+
+    def test_precompile_fills_bytecode_cache(self):
+        with open(os.path.join(self.templates_dir.name, 'template1.html'), 'w') as f:
+            f.write('<html><body>{{ title }}</body></html>')
+        with open(os.path.join(self.templates_dir.name, 'broken.html'), 'w') as f:
+            f.write('{% for %}')
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            templating = Templating(self.templates_dir.name, bytecode_cache=cache_dir)
+            self.assertEqual(templating.precompile(), ['broken.html'])
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            templating = Templating(self.templates_dir.name, bytecode_cache=cache_dir)
+            with mock.patch.object(Environment, 'compile') as compile:
+                rendered = templating.render('template1.html', title='Home')
+            compile.assert_not_called()
+            self.assertEqual(rendered, '<html><body>Home</body></html>')
+
+    def test_render_stream(self):
+        with open(os.path.join(self.templates_dir.name, 'rows.xml'), 'w') as f:
+            f.write('<rows>{% for i in rows %}<row>{{ i }}</row>{% endfor %}</rows>')
+
+        chunks = list(self.templating.render_stream('rows.xml', stream_buffer_size=100, rows=range(1000)))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(''.join(chunks), self.templating.render('rows.xml', rows=range(1000)))
+
+        compressed = b''.join(self.templating.render_stream('rows.xml', gzip_output=True, rows=range(10)))
+        self.assertEqual(gzip.decompress(compressed).decode(), self.templating.render('rows.xml', rows=range(10)))
+
+        with self.assertRaises(Exception):
+            list(self.templating.render_stream('rows.xml'))
+
+    def test_render_to_file_compressed_and_file_objects(self):
+        with open(os.path.join(self.templates_dir.name, 'template1.html'), 'w') as f:
+            f.write('<html><body>{{ title }}</body></html>')
+        expected = '<html><body>Home</body></html>'
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            path = os.path.join(output_dir, 'output.html.gz')
+            self.templating.render_to_file('template1.html', path, gzip_output=True, title='Home')
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(f.read(), expected)
+
+        text, binary = io.StringIO(), io.BytesIO()
+        self.templating.render_to_file('template1.html', text, title='Home')
+        self.templating.render_to_file('template1.html', binary, title='Home')
+        self.assertEqual(text.getvalue(), expected)
+        self.assertEqual(binary.getvalue(), expected.encode())
+
+    def test_streaming_keeps_template_variables(self):
+        with open(os.path.join(self.templates_dir.name, 'flags.txt'), 'w') as f:
+            f.write('{{ compress }} {{ buffer_size }}')
+
+        text = io.StringIO()
+        self.templating.render_to_file('flags.txt', text, compress=True, buffer_size=5)
+        self.assertEqual(text.getvalue(), 'True 5')
+        self.assertEqual(''.join(self.templating.render_stream('flags.txt', compress=1, buffer_size=2)), '1 2')
+
+    def test_production_mode_skips_file_system(self):
+        path = os.path.join(self.templates_dir.name, 'template1.html')
+        with open(path, 'w') as f:
+            f.write('<p>{{ title }}</p>')
+        templating = Templating(self.templates_dir.name, production=True)
+        self.assertEqual(templating.render('template1.html', title='Home'), '<p>Home</p>')
+
+        with open(path, 'w') as f:
+            f.write('<div>{{ title }}</div>')
+        with mock.patch.object(FileSystemLoader, 'get_source') as get_source:
+            self.assertEqual(templating.render('template1.html', title='Home'), '<p>Home</p>')
+            templating.load_template('template1.html')
+        get_source.assert_not_called()
+
+        templating.invalidate('template1.html')
+        self.assertEqual(templating.render('template1.html', title='Home'), '<div>Home</div>')
+        with self.assertRaises(FileNotFoundError):
+            templating.load_template('nonexistent_template.html')
+
+    def test_render_many(self):
+        with open(os.path.join(self.templates_dir.name, 'asset.xml'), 'w') as f:
+            f.write('<asset>{{ name }}</asset>')
+        contexts = [{'name': f'Asset {i}'} for i in range(9)] + [{}]
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = [os.path.join(output_dir, f'{i}.xml') for i in range(10)]
+            for workers in (1, 2):
+                results = self.templating.render_many('asset.xml', contexts, paths, workers=workers)
+
+                self.assertEqual([r['path'] for r in results], paths)
+                self.assertTrue(all(r['error'] is None for r in results[:9]))
+                self.assertIn('name', results[9]['error'])
+                with open(paths[4]) as f:
+                    self.assertEqual(f.read(), '<asset>Asset 4</asset>')
+
+            with self.assertRaises(ValueError):
+                self.templating.render_many('asset.xml', contexts, paths[:1])
+
+    def test_render_many_uses_the_options_of_the_parent(self):
+        with open(os.path.join(self.templates_dir.name, 'asset.xml'), 'w') as f:
+            f.write('<asset>{% cache "header" %}Header{% endcache %} {{ name }}</asset>')
+        contexts = [{'name': f'Asset {i}'} for i in range(4)]
+
+        with tempfile.TemporaryDirectory() as build_dir:
+            target = os.path.join(build_dir, 'templates.zip')
+            Templating(self.templates_dir.name, enable_async=True).compile_templates(target)
+            templating = Templating(
+                self.templates_dir.name, enable_async=True, precompiled=target, fragment_cache_size=8, profile=True
+            )
+            paths = [os.path.join(build_dir, f'{i}.xml.gz') for i in range(4)]
+            results = templating.render_many('asset.xml', contexts, paths, workers=2, gzip_output=True)
+
+            self.assertTrue(all(r['error'] is None for r in results))
+            with gzip.open(paths[3], 'rt') as f:
+                self.assertEqual(f.read(), '<asset>Header Asset 3</asset>')
+
+    def test_render_async(self):
+        with open(os.path.join(self.templates_dir.name, 'rows.xml'), 'w') as f:
+            f.write('<rows>{% for i in rows %}<row>{{ lookup(i) }}</row>{% endfor %}</rows>')
+
+        async def lookup(i):
+            await asyncio.sleep(0.01)
+            return i * 2
+
+        async def render():
+            templating = Templating(self.templates_dir.name, enable_async=True)
+            rendered = await asyncio.gather(
+                *(templating.render_async('rows.xml', rows=range(3), lookup=lookup) for _ in range(20))
+            )
+            chunks = [
+                chunk
+                async for chunk in templating.render_stream_async(
+                    'rows.xml', stream_buffer_size=10, gzip_output=True, rows=range(3), lookup=lookup
+                )
+            ]
+            return rendered, chunks
+
+        rendered, chunks = asyncio.run(render())
+        expected = '<rows><row>0</row><row>2</row><row>4</row></rows>'
+        self.assertEqual(rendered, [expected] * 20)
+        self.assertEqual(gzip.decompress(b''.join(chunks)).decode(), expected)
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self.templating.render_async('rows.xml', rows=[], lookup=lookup))
+
+    def test_compile_templates_and_load_precompiled(self):
+        with open(os.path.join(self.templates_dir.name, 'template1.html'), 'w') as f:
+            f.write('<html><body>{{ title }}</body></html>')
+        with open(os.path.join(self.templates_dir.name, 'broken.html'), 'w') as f:
+            f.write('{% for %}')
+
+        with tempfile.TemporaryDirectory() as build_dir:
+            for zip in (True, False):
+                target = os.path.join(build_dir, 'templates.zip' if zip else 'templates')
+                self.assertEqual(self.templating.compile_templates(target, zip=zip), ['broken.html'])
+
+                templating = Templating(self.templates_dir.name, precompiled=target)
+                self.assertEqual(templating.list_templates(), ['broken.html', 'template1.html'])
+                with mock.patch.object(Environment, 'compile') as compile, \
+                        mock.patch.object(FileSystemLoader, 'get_source') as get_source:
+                    rendered = templating.render('template1.html', title='Home')
+                compile.assert_not_called()
+                get_source.assert_not_called()
+                self.assertEqual(rendered, '<html><body>Home</body></html>')
+
+            with self.assertRaises(FileNotFoundError):
+                Templating(self.templates_dir.name, precompiled=os.path.join(build_dir, 'missing.zip'))
+            with self.assertRaises(ValueError):
+                Templating(self.templates_dir.name, precompiled=target, enable_async=True)
+            with mock.patch('pyprediktorutilities.templating.jinja2_version', '0.0'):
+                with self.assertRaises(ValueError):
+                    Templating(self.templates_dir.name, precompiled=target)
+
+    def test_fragment_cache(self):
+        with open(os.path.join(self.templates_dir.name, 'report.html'), 'w') as f:
+            f.write('{% cache plant %}<h1>{{ header(plant) }}</h1>{% endcache %}<p>{{ value }}</p>')
+        calls = []
+
+        def header(plant):
+            calls.append(plant)
+            return plant.upper()
+
+        templating = Templating(self.templates_dir.name, fragment_cache_size=2)
+        rendered = [templating.render('report.html', plant=p, value=i, header=header)
+                    for i, p in enumerate(['a', 'b', 'a', 'a', 'c', 'b'])]
+
+        self.assertEqual(rendered[3], '<h1>A</h1><p>3</p>')
+        self.assertEqual(calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual(templating.fragment_cache_stats, {'hits': 2, 'misses': 4, 'entries': 2})
+
+        templating.invalidate('report.html')
+        self.assertEqual(templating.fragment_cache_stats['entries'], 0)
+
+        async def header_async(plant):
+            calls.append(plant)
+            return plant.upper()
+
+        async def render():
+            templating = Templating(self.templates_dir.name, enable_async=True)
+            return [await templating.render_async('report.html', plant='d', value=i, header=header_async)
+                    for i in range(3)]
+
+        self.assertEqual(asyncio.run(render())[2], '<h1>D</h1><p>2</p>')
+        self.assertEqual(calls.count('d'), 1)
+
+    def test_profile(self):
+        with open(os.path.join(self.templates_dir.name, 'base.html'), 'w') as f:
+            f.write('<html>{% block head %}{% endblock %}{% block body %}{% endblock %}</html>')
+        with open(os.path.join(self.templates_dir.name, 'page.html'), 'w') as f:
+            f.write('{% extends "base.html" %}{% block head %}<h1>{{ title }}</h1>{% endblock %}'
+                    '{% block body %}{% for row in rows %}<p>{{ slow(row) }}</p>{% endfor %}{% endblock %}')
+        records = []
+
+        def slow(row):
+            time.sleep(0.01)
+            return row
+
+        templating = Templating(self.templates_dir.name, profile=records.append)
+        rendered = templating.render('page.html', title='Home', rows=range(3), slow=slow)
+        streamed = ''.join(templating.render_stream('page.html', title='Home', rows=range(3), slow=slow))
+        self.assertEqual(rendered, streamed)
+
+        self.assertEqual(sorted(r['template'] for r in records if r['event'] == 'compile'), ['base.html', 'page.html'])
+        renders = [r for r in records if r['event'] == 'render']
+        self.assertEqual(len(renders), 2)
+        self.assertEqual(renders[0]['size'], len(rendered))
+        self.assertGreaterEqual(renders[0]['blocks']['body'], 0.03)
+        self.assertLess(renders[0]['blocks']['head'], renders[0]['blocks']['body'])
+
+        summary = templating.profile_summary()
+        self.assertEqual(summary['page.html']['renders'], 2)
+        self.assertEqual(summary['base.html']['compiles'], 1)
+        self.assertGreaterEqual(summary['page.html']['render_seconds'], 0.06)
+        report = templating.profile_report()
+        self.assertLess(report.index('page.html'), report.index('block body'))
+        self.assertEqual(self.templating.profile_summary(), {})
+
+        templating.render(templating.env.from_string('{{ title }}'), title='Home')
+        self.assertEqual(templating.profile_summary()['<string>']['renders'], 1)
+        self.assertIn('<string>', templating.profile_report())